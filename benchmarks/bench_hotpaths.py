@@ -0,0 +1,236 @@
+"""読み込み・検出・描画・保存のホットパスのベンチマーク
+
+合成画像を複数の解像度で生成し、各段階の処理時間（p50/p95）と
+ピーク RSS を計測して JSON に書き出す。段階ごとに別プロセスで実行するので、
+ピーク RSS はその段階だけのもの。モデル（yolov11n-face.onnx / .pt）が無い場合は検出をスタブで代用する。
+
+使い方:
+    python benchmarks/bench_hotpaths.py [--sizes 1024x768,3000x2000,6000x4000] [--repeat 5] [--json bench_results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cropimage_core import (  # noqa: E402
+    OUTPUT_SIZE, PRESETS, default_model_path, detect_face_boxes, load_model, load_region, open_preview, render_face_crop,
+)
+from cropimage_detect import BatchFaceDetector  # noqa: E402
+from cropimage_output import ENCODER_PRESETS, encode, write_atomic  # noqa: E402
+from cropimage_render import ViewportRenderer  # noqa: E402
+from cropimage_save import make_job, run_save_job  # noqa: E402
+
+DEFAULT_SIZES = "1024x768,3000x2000,6000x4000"
+DISPLAY_SCALES = (0.25, 0.5, 1.0, 2.0)
+VIEW_SIZE = (1200, 750)
+
+
+class StubDetector:
+    """検出器の代わり（前処理相当のリサイズだけ行い、中央に顔が1つあるとみなす）"""
+
+    imgsz = 640
+
+    def detect(self, image, conf):
+        if isinstance(image, str):
+            image = Image.open(image)
+        image.convert("RGB").resize((self.imgsz, self.imgsz), Image.BILINEAR)
+        w, h = image.size
+        return [(w * 0.4, h * 0.3, w * 0.6, h * 0.6)], [0.9]
+
+    def detect_batch(self, arrays, conf):
+        return [self.detect(Image.fromarray(array), conf) for array in arrays]
+
+
+def make_model(model_path=None):
+    model_path = model_path or default_model_path()
+    if os.path.exists(model_path):
+        return load_model(model_path), os.path.splitext(model_path)[1].lstrip(".")
+    return StubDetector(), "stub"
+
+
+def synthetic_image(width, height, seed=0):
+    """グラデーションにノイズを加えた RGB 画像（圧縮率が実写に近くなるように）"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                     (x + y) / 2 * np.ones((height, width), np.float32)], axis=-1)
+    noise = rng.normal(0, 12, (height, width, 3)).astype(np.float32)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+def peak_rss_mb():
+    # Linux では VmHWM を使う（ru_maxrss は exec 前の親プロセス分を引き継ぐため）
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def percentile(values, q):
+    return float(np.percentile(np.asarray(values) * 1000, q))
+
+
+def timed(fn, repeat):
+    fn()  # ウォームアップ
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+# ---- 段階ごとの処理（子プロセスで実行） ----
+
+def stage_load(path, repeat, **_):
+    """load_image 相当：プレビューのデコード（比較用に従来の全解像度 RGBA デコードも計測）"""
+    return {
+        "load_preview": timed(lambda: open_preview(path), repeat),
+        "load_full_rgba": timed(lambda: Image.open(path).convert("RGBA"), repeat),
+    }
+
+
+def stage_display(path, repeat, **_):
+    """display_image 相当：可視領域の描画（倍率ごと、操作中/確定後）"""
+    preview, full_size = open_preview(path)
+    results = {}
+    for scale in DISPLAY_SCALES:
+        offset = [-(full_size[0] * scale - VIEW_SIZE[0]) / 2, -(full_size[1] * scale - VIEW_SIZE[1]) / 2]
+        for fast in (True, False):
+            renderer = ViewportRenderer(preview, full_size)
+            renderer.render(scale, offset, VIEW_SIZE, fast=fast)  # ピラミッドを作っておく
+            name = f"display_{'fast' if fast else 'lanczos'}_x{scale:g}"
+            results[name] = timed(lambda: renderer.render(scale, offset, VIEW_SIZE, fast=fast), repeat)
+    return results
+
+
+def stage_crop(path, repeat, output_dir, **_):
+    """crop_selected_face 相当：クロップ範囲の読み込み → 仕上げ（プリセットごと） → 保存（形式ごと）"""
+    with Image.open(path) as image:
+        width, height = image.size
+    side = min(width, height) * 0.5
+    box = ((width - side) / 2, (height - side) / 2, (width + side) / 2, (height + side) / 2)
+    region = load_region(path, box)
+    output_path = os.path.join(output_dir, "crop.png")
+    results = {"crop_load_region": timed(lambda: load_region(path, box), repeat)}
+    for preset in PRESETS:
+        job = make_job(path, box, output_path, OUTPUT_SIZE, pipeline="face", preset=preset)
+        results[f"crop_render_{preset}"] = timed(
+            lambda: render_face_crop(region, (0, 0) + region.size, OUTPUT_SIZE, preset), repeat
+        )
+        results[f"crop_total_{preset}"] = timed(lambda: run_save_job(job), repeat)
+    final = render_face_crop(region, (0, 0) + region.size, OUTPUT_SIZE)
+    for name, encoder in ENCODER_PRESETS.items():
+        results[f"crop_encode_{name}"] = timed(lambda: write_atomic(output_path, encode(final, encoder)), repeat)
+    return results
+
+
+def stage_predict(path, repeat, model_path=None, **_):
+    """推論：1枚ずつの推論と、バッチ推論エンジンでの推論（結果名にバックエンドを付ける）"""
+    model, kind = make_model(model_path)
+    preview, full_size = open_preview(path)
+    batch = [path] * 8
+    detector = BatchFaceDetector(model, batch_size=8)
+    return {
+        f"predict_single_{kind}": timed(lambda: detect_face_boxes(model, preview, full_size=full_size), repeat),
+        f"predict_batch8_{kind}": [t / len(batch) for t in timed(lambda: list(detector.detect(batch)), repeat)],
+    }
+
+
+STAGES = {
+    "load": stage_load,
+    "display": stage_display,
+    "crop": stage_crop,
+    "predict": stage_predict,
+}
+
+
+def _run_stage(stage, path, repeat, output_dir, model_path):
+    samples = STAGES[stage](path, repeat, output_dir=output_dir, model_path=model_path)
+    return samples, peak_rss_mb()
+
+
+def run(sizes, repeat, stages, formats=("jpeg", "png"), model_paths=(None,)):
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        for width, height in sizes:
+            image = synthetic_image(width, height)
+            for fmt in formats:
+                path = os.path.join(tmp, f"synthetic_{width}x{height}.{'jpg' if fmt == 'jpeg' else fmt}")
+                if fmt == "jpeg":
+                    image.save(path, quality=90)
+                else:
+                    image.save(path)
+                # predict は指定されたモデルごとに計測する（バックエンドの比較用）
+                runs = [(stage, m) for stage in stages for m in (model_paths if stage == "predict" else (None,))]
+                for stage, model_path in runs:
+                    with ctx.Pool(1) as pool:
+                        samples, rss = pool.apply(_run_stage, (stage, path, repeat, tmp, model_path))
+                    for name, values in samples.items():
+                        results.append({
+                            "stage": name,
+                            "resolution": f"{width}x{height}",
+                            "format": fmt,
+                            "p50_ms": percentile(values, 50),
+                            "p95_ms": percentile(values, 95),
+                            "samples": len(values),
+                            "peak_rss_mb": rss,
+                        })
+                        r = results[-1]
+                        rss_text = f"{rss:8.1f}" if rss is not None else "     n/a"
+                        print(f"{r['resolution']:>10} {fmt:>4} {name:<28} p50 {r['p50_ms']:9.2f} ms  "
+                              f"p95 {r['p95_ms']:9.2f} ms  peak RSS {rss_text} MB")
+    return results
+
+
+def parse_sizes(text):
+    return [tuple(int(v) for v in s.lower().split("x")) for s in text.split(",") if s]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark load/detect/render/save hot paths.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated WxH list")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated subset of: " + ",".join(STAGES))
+    parser.add_argument("--json", default="bench_results.json", help="machine-readable output path")
+    parser.add_argument("--model", action="append", default=None,
+                        help="detector model for the predict stage (.onnx or .pt; repeat to compare backends)")
+    args = parser.parse_args(argv)
+
+    stages = [s for s in args.stages.split(",") if s]
+    results = run(parse_sizes(args.sizes), args.repeat, stages, model_paths=args.model or (None,))
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.json, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""ultralytics（.pt）と ONNX Runtime（.onnx）の検出結果・速度の比較
+
+同じレターボックス済みの配列を両方の detect_batch に渡し、枠を IoU で対応付けて
+IoU・信頼度の差が許容範囲内かを確認する。あわせて推論の images/s を比べる。
+モデルが無くても、ONNX 版の後処理（postprocess）の回帰チェックだけは実行する。
+いずれかが失敗すると終了コード 1 を返す。
+
+使い方:
+    python benchmarks/check_backend_parity.py --pt yolov11n-face.pt --onnx yolov11n-face.onnx --images SAMPLE_DIR
+    python benchmarks/check_backend_parity.py          # postprocess の回帰チェックのみ
+"""
+import argparse
+import os
+import sys
+import time
+from itertools import islice
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cropimage_backends import OnnxDetector, UltralyticsDetector, postprocess  # noqa: E402
+from cropimage_core import DEFAULT_CONF  # noqa: E402
+from cropimage_detect import letterbox  # noqa: E402
+from cropimage_scan import iter_images  # noqa: E402
+
+DEFAULT_MIN_IOU = 0.9  # 対応する枠はこれ以上重なっていること
+DEFAULT_CONF_TOLERANCE = 0.05  # 信頼度の差の許容値
+
+
+def iou_matrix(a, b):
+    """xyxy の (N, 4) と (M, 4) の IoU を (N, M) で返す"""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    w = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    h = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    inter = np.clip(w, 0, None) * np.clip(h, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def match_boxes(boxes_a, boxes_b):
+    """IoU の大きい組から貪欲に対応付け、(i, j, IoU) のリストと対応しなかった枠の数を返す"""
+    if not len(boxes_a) or not len(boxes_b):
+        return [], len(boxes_a) + len(boxes_b)
+    ious = iou_matrix(boxes_a, boxes_b)
+    pairs = []
+    while ious.size and ious.max() > 0:
+        i, j = np.unravel_index(np.argmax(ious), ious.shape)
+        pairs.append((i, j, float(ious[i, j])))
+        ious[i, :] = -1
+        ious[:, j] = -1
+    return pairs, len(boxes_a) + len(boxes_b) - 2 * len(pairs)
+
+
+def check_postprocess():
+    """postprocess の回帰チェック（中心・幅高さ → xyxy、しきい値、NMS、信頼度順）"""
+    anchors = np.array([
+        # cx, cy, w, h, score
+        [100, 100, 40, 60, 0.80],  # 次の枠と大きく重なるので NMS で除かれる
+        [101, 101, 40, 60, 0.90],
+        [300, 200, 50, 50, 0.50],
+        [500, 500, 30, 30, 0.20],  # conf 未満
+    ], dtype=np.float32).T
+    boxes, confidences = postprocess(anchors, conf=0.3)
+    expected_boxes = [[81, 71, 121, 131], [275, 175, 325, 225]]
+    expected_confidences = [0.9, 0.5]
+    ok = (np.allclose(boxes, expected_boxes, atol=1e-4)
+          and np.allclose(confidences, expected_confidences, atol=1e-6))
+    empty = postprocess(anchors, conf=0.95) == ([], [])
+    print(f"postprocess regression: {'OK' if ok and empty else 'FAILED'}")
+    if not ok:
+        print(f"  got {boxes} {confidences}, expected {expected_boxes} {expected_confidences}")
+    return ok and empty
+
+
+def load_arrays(image_dir, imgsz, limit):
+    arrays = []
+    for path in islice(iter_images(image_dir, recursive=True), limit):
+        with Image.open(path) as image:
+            arrays.append(letterbox(image, imgsz)[0])
+    return arrays
+
+
+def run_batches(detector, arrays, conf, batch_size):
+    """全配列を batch_size ずつ推論し、(結果, 秒) を返す（最初のバッチでウォームアップする）"""
+    detector.detect_batch(arrays[:batch_size], conf)
+    start = time.perf_counter()
+    results = []
+    for i in range(0, len(arrays), batch_size):
+        results.extend(detector.detect_batch(arrays[i:i + batch_size], conf))
+    return results, time.perf_counter() - start
+
+
+def check_parity(pt_path, onnx_path, image_dir, conf, min_iou, conf_tolerance, batch_size, limit):
+    onnx = OnnxDetector(onnx_path)
+    ultralytics = UltralyticsDetector(pt_path, imgsz=onnx.imgsz)
+    arrays = load_arrays(image_dir, onnx.imgsz, limit)
+    if not arrays:
+        print(f"No images found in {image_dir}")
+        return False
+    expected, pt_seconds = run_batches(ultralytics, arrays, conf, batch_size)
+    actual, onnx_seconds = run_batches(onnx, arrays, conf, batch_size)
+
+    failures = 0
+    worst_iou = 1.0
+    worst_conf = 0.0
+    for index, ((pt_boxes, pt_confs), (onnx_boxes, onnx_confs)) in enumerate(zip(expected, actual)):
+        pairs, unmatched = match_boxes(pt_boxes, onnx_boxes)
+        bad = [(i, j, iou) for i, j, iou in pairs
+               if iou < min_iou or abs(pt_confs[i] - onnx_confs[j]) > conf_tolerance]
+        for i, j, iou in pairs:
+            worst_iou = min(worst_iou, iou)
+            worst_conf = max(worst_conf, abs(pt_confs[i] - onnx_confs[j]))
+        if unmatched or bad:
+            failures += 1
+            print(f"  image {index}: {len(pt_boxes)} vs {len(onnx_boxes)} boxes, {unmatched} unmatched, "
+                  f"{len(bad)} outside tolerance")
+
+    print(f"boxes: {len(arrays) - failures}/{len(arrays)} images match "
+          f"(worst IoU {worst_iou:.3f}, worst confidence diff {worst_conf:.3f})")
+    print(f"speed: ultralytics {len(arrays) / pt_seconds:.1f} images/s, "
+          f"onnx {len(arrays) / onnx_seconds:.1f} images/s ({pt_seconds / onnx_seconds:.2f}x)")
+    return failures == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the ultralytics and ONNX Runtime detector backends.")
+    parser.add_argument("--pt", default=None, help="ultralytics .pt model")
+    parser.add_argument("--onnx", default=None, help="ONNX model exported from the same .pt")
+    parser.add_argument("--images", default=None, help="folder of sample images (preferably with faces)")
+    parser.add_argument("--limit", type=int, default=200, help="maximum number of images to compare")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--conf", type=float, default=DEFAULT_CONF)
+    parser.add_argument("--min-iou", type=float, default=DEFAULT_MIN_IOU)
+    parser.add_argument("--conf-tolerance", type=float, default=DEFAULT_CONF_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    ok = check_postprocess()
+    if args.pt and args.onnx and args.images:
+        ok = check_parity(args.pt, args.onnx, args.images, args.conf, args.min_iou, args.conf_tolerance,
+                          args.batch_size, args.limit) and ok
+    else:
+        print("Backend parity skipped (pass --pt, --onnx and --images to compare the models)")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""セッションマニフェストの再開判定（is_done）の回帰チェック
+
+一時ディレクトリにマニフェストを書き、記録の並びごとに is_done と、
+ファイルを読み直して復元した状態での is_done が期待どおりかを確認する。
+いずれかが失敗すると終了コード 1 を返す。
+
+使い方:
+    python benchmarks/check_session_resume.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cropimage_session import DONE, FAILED, QUEUED, SKIPPED, SessionManifest  # noqa: E402
+
+BOX = (0, 0, 100, 100)
+
+# (説明, [(状態, 出力あり)], 期待する is_done)
+CASES = [
+    ("done", [(QUEUED, True), (DONE, True)], True),
+    ("queued only", [(QUEUED, True)], False),
+    ("skipped", [(SKIPPED, False)], True),
+    ("decode failed", [(FAILED, False)], False),
+    ("decode failed, then skipped", [(FAILED, False), (SKIPPED, False)], True),
+    ("decode failed, then done", [(FAILED, False), (QUEUED, True), (DONE, True)], True),
+    ("decode failed, then queued", [(FAILED, False), (QUEUED, True)], False),
+    ("done, then decode failed", [(QUEUED, True), (DONE, True), (FAILED, False)], False),
+    ("write failed", [(QUEUED, True), (FAILED, True)], False),
+]
+
+
+def check_case(directory, index, records, expected):
+    path = os.path.join(directory, f"session_{index}.jsonl")
+    source = os.path.join(directory, f"image_{index}.jpg")
+    output = os.path.join(directory, f"image_{index}_face1.png")
+    manifest = SessionManifest(path)
+    for status, has_output in records:
+        if has_output:
+            manifest.append(source, status, BOX, output)
+        else:
+            manifest.append(source, status)
+    live = manifest.is_done(source)
+    manifest.close()
+    manifest = SessionManifest(path)
+    replayed = manifest.is_done(source)
+    manifest.close()
+    return live == expected and replayed == expected, live, replayed
+
+
+def main():
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        for index, (name, records, expected) in enumerate(CASES):
+            passed, live, replayed = check_case(directory, index, records, expected)
+            if not passed:
+                ok = False
+                print(f"  {name}: is_done {live} (replayed {replayed}), expected {expected}")
+    print(f"session resume: {'OK' if ok else 'FAILED'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
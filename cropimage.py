@@ -1,10 +1,23 @@
+import argparse
 import os
-from tkinter import Tk, Canvas, Button, Label, filedialog
-from PIL import Image, ImageTk
+from functools import partial
+from tkinter import Tk, Canvas, Button, Label, Checkbutton, BooleanVar, OptionMenu, StringVar, filedialog
+from PIL import ImageTk
+
+from cropimage_core import DEFAULT_PRESET, PRESETS, load_region
+from cropimage_api import Cropper, scan_folder
+from cropimage_prefetch import ImagePrefetcher
+from cropimage_render import DETAIL_POLL_MS, REFINE_DELAY_MS, ViewportRenderer
+from cropimage_output import ENCODER_PRESETS
+from cropimage_perf import PerfLog, add_arguments as add_perf_arguments, collect, profile_from_args
+from cropimage_save import SaveQueue, gui_worker_count
+from cropimage_session import DONE, FAILED, MANIFEST_NAME, QUEUED, SessionManifest
+from cropimage_view import center_box, center_crop_box
+from cropimage_source import SourceTooLargeError, clear_mapped_sources, remove_stale_mapped_sources
 
 
 class ImageCropper:
-    def __init__(self, root):
+    def __init__(self, root, perf_log_path=None, profile=None):
         self.root = root
         self.root.title("Accurate Crop Tool - Save as 1024x1024")
 
@@ -21,69 +34,227 @@ class ImageCropper:
         self.save_btn = Button(self.control_frame, text="Crop & Save", command=self.crop_and_save, state="disabled")
         self.save_btn.pack(side="left", padx=10)
 
+        self.recursive_var = BooleanVar(value=False)
+        self.recursive_check = Checkbutton(self.control_frame, text="Include subfolders", variable=self.recursive_var, bg="white")
+        self.recursive_check.pack(side="left", padx=10)
+
+        self.dedup_var = BooleanVar(value=False)  # Skip near-duplicate images (perceptual hash)
+        self.dedup_check = Checkbutton(self.control_frame, text="Skip duplicates", variable=self.dedup_var, bg="white")
+        self.dedup_check.pack(side="left", padx=10)
+
+        self.preset_var = StringVar(value=DEFAULT_PRESET)  # Output quality preset
+        self.preset_menu = OptionMenu(self.control_frame, self.preset_var, *PRESETS)
+        self.preset_menu.pack(side="left", padx=10)
+
+        self.format_var = StringVar(value="png")  # Output format
+        self.format_menu = OptionMenu(self.control_frame, self.format_var, "png", "png-fast", "jpeg", "webp")
+        self.format_menu.pack(side="left", padx=10)
+
         self.status_label = Label(self.control_frame, text="No folder selected", bg="white")
         self.status_label.pack(side="left", padx=10)
 
+        self.save_status_label = Label(self.control_frame, text="", bg="white")
+        self.save_status_label.pack(side="left", padx=10)
+
         # Attributes
-        self.image_list = []
+        self.image_list = []  # Grows while the folder scanner runs
         self.current_image_index = 0
-        self.original_image = None
+        self.scanner = None  # Background folder scanner
+        self.waiting_for_image = False  # True while the next image has not been found by the scanner yet
+        self.original_image = None  # Reduced-resolution preview; full resolution is decoded only when saving
+        self.full_size = None  # Size of the source image (all coordinates use this resolution)
         self.tk_image = None
+        self.renderer = None  # Renders only the visible part of original_image
+        self.refine_job = None
+        self.detail_job = None  # Polls for the full-resolution region being loaded in the background
+        self.display_job = None  # Pending after_idle redraw (motion events are coalesced into one)
+        self.display_interactive = False
+        self.image_item = None  # Canvas items are created once and then only moved
+        self.frame_item = None
         self.image_offset = [0, 0]  # Offset of image top-left corner
         self.scale = 1.0
         self.crop_size = 512  # Fixed red frame size for display
         self.output_size = 1024  # Final output size
+        # Loading and crop/resize settings shared with the headless API (crop -> LANCZOS)
+        self.cropper = Cropper(output_size=self.output_size, pipeline="plain")
+        # Per-stage timings (written as JSONL only when a path is given) and the optional profile capture
+        self.perf_log = PerfLog(perf_log_path)
+        self.profile = profile
+        # Decodes upcoming images in the background (the profile captures those loads on the prefetch threads)
+        self.prefetcher = ImagePrefetcher(self.decode_image, profile=profile)
+        # Crops/resizes/saves in worker processes (after removing map files left by crashed runs)
+        remove_stale_mapped_sources()
+        self.save_queue = SaveQueue(max_workers=gui_worker_count(), on_done=self.on_save_done, perf_log=self.perf_log)
+        self.manifest = None  # Session manifest in the output folder (opened with the first folder)
 
         # Event Bindings
         self.canvas.bind("<Configure>", self.on_resize)
         self.canvas.bind("<B1-Motion>", self.on_drag)
         self.canvas.bind("<ButtonPress-1>", self.on_drag_start)
         self.canvas.bind("<MouseWheel>", self.on_zoom)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.poll_save_status()
 
     def open_folder(self):
         folder_path = filedialog.askdirectory()
         if folder_path:
-            self.image_list = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.lower().endswith(('png', 'jpg', 'jpeg'))]
+            if self.scanner is not None:
+                self.scanner.cancel()
+            # Scan in the background; image_list is the scanner's growing list
+            # Skipped duplicates are logged to output/duplicates.jsonl for review
+            self.scanner = scan_folder(folder_path, "output", recursive=self.recursive_var.get(),
+                                       dedup=self.dedup_var.get(), perf_log=self.perf_log)
+            self.open_manifest()
+            self.image_list = self.scanner.paths
+            self.prefetcher.reset(self.image_list)
             self.current_image_index = 0
-            if self.image_list:
-                os.makedirs("output", exist_ok=True)
-                self.status_label.config(text=f"{len(self.image_list)} images loaded.")
+            self.waiting_for_image = True
+            self.save_btn.config(state="disabled")
+            self.status_label.config(text="Scanning folder...")
+            self.scanner.start()
+            self.poll_scan(self.scanner)
+
+    def poll_scan(self, scanner):
+        if scanner is not self.scanner:
+            return  # A different folder was opened
+        finished = scanner.finished
+        if self.waiting_for_image:
+            # Resume at the first image without a finished crop
+            self.current_image_index = self.manifest.next_unprocessed(self.image_list, self.current_image_index)
+            if self.current_image_index < len(self.image_list):
+                self.waiting_for_image = False
                 self.load_image()
                 self.save_btn.config(state="normal")
-            else:
-                self.status_label.config(text="No images found in selected folder.")
+            elif finished:
+                self.waiting_for_image = False
+                self.status_label.config(text="All images processed!" if self.image_list else "No images found in selected folder.")
+                return
+        skipped = f" ({scanner.duplicates} duplicates skipped)" if scanner.duplicates else ""
+        if finished:
+            self.status_label.config(text=f"{len(self.image_list)} images loaded{skipped}.")
+        else:
+            self.status_label.config(text=f"{len(self.image_list)} images found{skipped}, scanning...")
+            self.root.after(100, self.poll_scan, scanner)
+
+    def open_manifest(self):
+        if self.manifest is not None:
+            return
+        self.manifest = SessionManifest(os.path.join("output", MANIFEST_NAME))
+        # Re-submit crops that were queued but never written (e.g. after a crash)
+        for job in self.manifest.interrupted_jobs():
+            self.save_queue.submit(job)
+
+    def decode_image(self, image_path):
+        # Runs on a prefetch worker thread; must not touch Tk
+        with collect() as timings:
+            image = self.cropper.load(image_path)
+        self.perf_log.record(image_path, "load", timings)
+        return image
 
     def load_image(self):
         image_path = self.image_list[self.current_image_index]
-        self.original_image = Image.open(image_path).convert("RGBA")
+        if self.profile is not None:
+            self.profile.on_image(self.current_image_index)
+        try:
+            image = self.prefetcher.get(self.current_image_index)
+        except SourceTooLargeError as e:
+            # Skip images over the pixel limit instead of crashing
+            print(f"Skipped: {e}")
+            self.status_label.config(text=f"Skipped (too large): {os.path.basename(image_path)}")
+            self.next_image()
+            return
+        except OSError as e:
+            # Corrupt or unreadable file: record it so a resume retries it, and move on
+            print(f"Failed to decode {image_path}: {e}")
+            self.manifest.append(image_path, FAILED)
+            self.status_label.config(text=f"Failed to load: {os.path.basename(image_path)}")
+            self.next_image()
+            return
+        self.original_image, self.full_size = image.preview, image.full_size
+        if self.renderer is not None:
+            self.renderer.cancel()
+        # When zoomed in past the preview's resolution, draw from the original (visible tiles only,
+        # read off the Tk thread; the upscaled preview is shown until it arrives)
+        self.renderer = ViewportRenderer(self.original_image, self.full_size,
+                                         detail_loader=partial(load_region, image_path))
+        self.tk_image = None
         self.image_offset = [0, 0]  # Reset offset
         self.scale = 1.0  # Reset scale
         self.display_image()
 
-    def display_image(self):
-        self.canvas.delete("all")
+    def display_image(self, interactive=False):
+        if self.renderer is None:
+            return
+        view_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+
+        # Resample only the visible region (fast filter while the user is dragging/zooming),
+        # and only when the rendered area no longer covers the view
+        if (self.tk_image is None or not self.renderer.covers(self.scale, self.image_offset, view_size)
+                or (not interactive and self.renderer.rendered_fast)):
+            with collect() as timings:
+                rendered = self.renderer.render(self.scale, self.image_offset, view_size, fast=interactive)
+            self.tk_image = ImageTk.PhotoImage(rendered[0]) if rendered is not None else None
+            self.perf_log.record(self.image_list[self.current_image_index], "display", timings,
+                                 interactive=interactive)
+            if self.renderer.detail_pending:
+                self.schedule_detail_poll()
+        if self.tk_image is None:
+            if self.image_item is not None:
+                self.canvas.itemconfig(self.image_item, state="hidden")
+        elif self.image_item is None:
+            self.image_item = self.canvas.create_image(0, 0, anchor="nw", tags="image")
+            self.canvas.tag_lower(self.image_item)
+        if self.tk_image is not None:
+            self.canvas.itemconfig(self.image_item, image=self.tk_image, state="normal")
+            self.canvas.coords(self.image_item, *self.renderer.placement(self.image_offset))
+        if interactive:
+            self.schedule_refine()
+
+        # Red crop frame
+        if self.frame_item is None:
+            self.frame_item = self.canvas.create_rectangle(0, 0, 0, 0, outline="red", width=2)
+        self.canvas.coords(self.frame_item, *center_box(view_size, self.crop_size))
+
+    def request_display(self, interactive=False):
+        # Coalesce bursts of motion events into a single redraw when Tk is idle
+        if self.display_job is None:
+            self.display_interactive = interactive
+            self.display_job = self.root.after_idle(self.flush_display)
+        else:
+            self.display_interactive = self.display_interactive and interactive
 
-        # Calculate scaled dimensions
-        scaled_width = int(self.original_image.width * self.scale)
-        scaled_height = int(self.original_image.height * self.scale)
-        resized_image = self.original_image.resize((scaled_width, scaled_height), Image.LANCZOS)
-        self.tk_image = ImageTk.PhotoImage(resized_image)
+    def flush_display(self):
+        self.display_job = None
+        self.display_image(interactive=self.display_interactive)
 
-        # Draw image on canvas
-        self.canvas.create_image(self.image_offset[0], self.image_offset[1], image=self.tk_image, anchor="nw")
+    def schedule_refine(self):
+        # Redraw with LANCZOS once input has been idle for REFINE_DELAY_MS
+        if self.refine_job is not None:
+            self.root.after_cancel(self.refine_job)
+        self.refine_job = self.root.after(REFINE_DELAY_MS, self.refine)
 
-        # Draw red crop frame
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
-        crop_left = (canvas_width - self.crop_size) // 2
-        crop_top = (canvas_height - self.crop_size) // 2
-        crop_right = crop_left + self.crop_size
-        crop_bottom = crop_top + self.crop_size
+    def refine(self):
+        self.refine_job = None
+        if self.renderer is not None and self.renderer.rendered_fast:
+            self.display_image()
 
-        self.canvas.create_rectangle(crop_left, crop_top, crop_right, crop_bottom, outline="red", width=2)
+    def schedule_detail_poll(self):
+        if self.detail_job is None:
+            self.detail_job = self.root.after(DETAIL_POLL_MS, self.poll_detail)
+
+    def poll_detail(self):
+        # Redraw once the full-resolution region has been loaded
+        self.detail_job = None
+        if self.renderer is None or not self.renderer.detail_pending:
+            return
+        if self.renderer.detail_ready():
+            self.tk_image = None
+            self.display_image()
+        else:
+            self.schedule_detail_poll()
 
     def on_resize(self, event):
-        self.display_image()
+        self.request_display()
 
     def on_drag_start(self, event):
         self.drag_start_x = event.x
@@ -96,54 +267,78 @@ class ImageCropper:
         self.image_offset[1] += dy
         self.drag_start_x = event.x
         self.drag_start_y = event.y
-        self.display_image()
+        # A pan inside the already rendered area only moves the image item
+        self.request_display(interactive=True)
 
     def on_zoom(self, event):
         zoom_factor = 1.1 if event.delta > 0 else 0.9
         self.scale *= zoom_factor
-        self.display_image()
+        self.request_display(interactive=True)
 
     def crop_and_save(self):
-        # Get crop box coordinates in Canvas
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
-        crop_left_canvas = (canvas_width - self.crop_size) // 2
-        crop_top_canvas = (canvas_height - self.crop_size) // 2
-
-        # Convert Canvas coordinates to original image coordinates
-        crop_left_image = (crop_left_canvas - self.image_offset[0]) / self.scale
-        crop_top_image = (crop_top_canvas - self.image_offset[1]) / self.scale
-        crop_right_image = crop_left_image + self.crop_size / self.scale
-        crop_bottom_image = crop_top_image + self.crop_size / self.scale
-
-        crop_box = (
-            int(crop_left_image),
-            int(crop_top_image),
-            int(crop_right_image),
-            int(crop_bottom_image)
-        )
-
-        # Crop the image
-        cropped_image = self.original_image.crop(crop_box)
-
-        # Resize the cropped image to 1024x1024
-        resized_image = cropped_image.resize((self.output_size, self.output_size), Image.LANCZOS)
+        # Original-image coordinates of the red frame
+        view_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        crop_box = center_crop_box(view_size, self.crop_size, self.scale, self.image_offset)
 
-        # Save the cropped image
-        output_path = os.path.join("output", f"cropped_{self.current_image_index + 1}.png")
-        resized_image.save(output_path)
-        print(f"Saved: {output_path}")
+        # Crop, resize to 1024x1024 and save in a worker process
+        image_path = self.image_list[self.current_image_index]
+        job = self.cropper.output_job(image_path, crop_box, "output", preset=self.preset_var.get(),
+                                      encoder=ENCODER_PRESETS[self.format_var.get()])
+        self.manifest.record_job(job, QUEUED)
+        self.save_queue.submit(job)
+        self.update_save_status()
+        self.next_image()
 
-        # Move to next image
-        self.current_image_index += 1
+    def next_image(self):
+        # Move to next unprocessed image
+        self.current_image_index = self.manifest.next_unprocessed(self.image_list, self.current_image_index + 1)
         if self.current_image_index < len(self.image_list):
             self.load_image()
+        elif not self.scanner.finished:
+            # poll_scan loads the next image once the scanner finds it
+            self.waiting_for_image = True
+            self.save_btn.config(state="disabled")
         else:
             self.status_label.config(text="All images processed!")
             self.save_btn.config(state="disabled")
 
+    def on_save_done(self, job, error):
+        # Called from the save queue's thread; only touches the manifest
+        if self.manifest is not None:
+            self.manifest.record_job(job, DONE if error is None else FAILED)
+
+    def update_save_status(self):
+        # Queue depths and rolling throughput, to tell disk/CPU-bound sessions apart
+        self.save_status_label.config(
+            text=f"{self.save_queue.status_text()} | Prefetch: {self.prefetcher.pending} pending, "
+                 f"{self.perf_log.rate('load'):.1f} images/s"
+        )
+
+    def poll_save_status(self):
+        self.update_save_status()
+        self.root.after(500, self.poll_save_status)
+
+    def on_close(self):
+        if self.scanner is not None:
+            self.scanner.cancel()
+        self.prefetcher.shutdown()
+        # Flush all pending writes before exiting
+        self.save_status_label.config(text=f"Flushing {self.save_queue.pending} pending writes...")
+        self.root.update_idletasks()
+        self.save_queue.close()
+        if self.profile is not None:
+            self.profile.finish()
+        self.perf_log.close()
+        if self.manifest is not None:
+            self.manifest.close()
+        clear_mapped_sources()
+        self.root.destroy()
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crop images to a fixed-size square.")
+    add_perf_arguments(parser)
+    args = parser.parse_args()
     root = Tk()
-    app = ImageCropper(root)
+    app = ImageCropper(root, perf_log_path=args.perf_log, profile=profile_from_args(args))
     root.mainloop()
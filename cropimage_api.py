@@ -0,0 +1,227 @@
+"""UI に依存しないクロップの API（GUI・一括処理・取り込みサービスから共通に使う）
+
+    cropper = Cropper()                                  # モデルは最初に検出するときに読む
+    image = cropper.load("a.jpg")                        # 縮小プレビューと元画像のサイズ
+    boxes = cropper.crop_boxes(cropper.detect(image), mode="largest")  # 元画像の座標の正方形の枠
+    crops = [cropper.render(image, box) for box in boxes]              # 出力サイズに仕上げた画像
+
+検出は縮小プレビューで行い、クロップは元の解像度で box の範囲だけをデコードする。
+仕上げ（プリセット・パイプライン）は保存キューのワーカーと同じ関数を使うので、結果は GUI で保存したものと一致する。
+
+asyncio からは AsyncCropper を使う。デコード・推論・クロップは executor（既定はスレッドプール）で実行し、
+process_stream は処理中の入力が concurrency 件に達している間は次の入力を取り出さない（バックプレッシャー）。
+Pillow のデコード・リサイズと ONNX Runtime の推論は GIL を解放するので、スレッドでも並列に進む。
+"""
+import asyncio
+import os
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from cropimage_core import (
+    DEFAULT_CONF, DEFAULT_PRESET, OUTPUT_SIZE,
+    box_area, detect_raw_boxes, expand_face_boxes, load_model, load_region, load_regions, open_preview, scale_boxes,
+)
+from cropimage_dedup import AUDIT_NAME, Deduplicator
+from cropimage_output import DEFAULT_ENCODER, encode, extension, write_atomic
+from cropimage_save import make_job, render_region
+from cropimage_scan import FolderScanner
+from cropimage_session import output_name
+
+MODES = ("all", "first", "largest")
+DEFAULT_CONCURRENCY = 4
+
+LoadedImage = namedtuple("LoadedImage", "path preview full_size")
+Crop = namedtuple("Crop", "box image")
+CropResult = namedtuple("CropResult", "path crops error")  # error は失敗したときの例外（crops は空）
+
+
+def select_boxes(face_boxes, mode="all"):
+    """mode（all / first / largest）に応じて出力する顔枠を選ぶ"""
+    if not face_boxes:
+        return []
+    if mode == "first":
+        return face_boxes[:1]
+    if mode == "largest":
+        return [max(face_boxes, key=box_area)]
+    return face_boxes
+
+
+def scan_folder(folder_path, output_dir="output", recursive=False, dedup=False, perf_log=None):
+    """出力先を用意し、フォルダのスキャナー（未開始の FolderScanner）を返す
+
+    dedup=True なら近い重複を除き、除いた画像を output_dir/duplicates.jsonl に記録する。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    deduplicator = Deduplicator(audit_path=os.path.join(output_dir, AUDIT_NAME)) if dedup else None
+    return FolderScanner(folder_path, recursive=recursive, dedup=deduplicator, perf_log=perf_log)
+
+
+class Cropper:
+    """読み込み・顔検出・クロップ範囲の計算・仕上げをまとめたもの（複数のスレッドから呼んでよい）
+
+    pipeline は "face"（DETAIL → LANCZOS → DETAIL）か "plain"（LANCZOS のみ）。
+    cache（cropimage_cache.DetectionCache）を渡すと検出結果を再利用する。
+    box_options は expand_face_boxes に渡す（merge_iou, min_face_size）。
+    """
+
+    def __init__(self, model=None, model_path=None, conf=DEFAULT_CONF, cache=None, output_size=OUTPUT_SIZE,
+                 pipeline="face", preset=DEFAULT_PRESET, encoder=DEFAULT_ENCODER, **box_options):
+        self._model = model
+        self.model_path = model_path
+        self.conf = conf
+        self.cache = cache
+        self.output_size = output_size
+        self.pipeline = pipeline
+        self.preset = preset
+        self.encoder = encoder
+        self.box_options = box_options
+        self.model_lock = threading.Lock()  # 推論は直列化する（検出器はスレッドセーフとは限らない）
+
+    @property
+    def model(self):
+        with self.model_lock:
+            if self._model is None:
+                self._model = load_model(self.model_path)
+            return self._model
+
+    def load(self, path):
+        """表示・検出用の縮小プレビューを読み込む（元の解像度は render まで読まない）"""
+        return LoadedImage(path, *open_preview(path))
+
+    def detect_raw(self, image):
+        """検出枠（元画像の座標の xyxy）と信頼度のリストを返す"""
+        if self.cache is not None:
+            cached = self.cache.get(image.path)
+            if cached is not None:
+                return cached
+        model = self.model
+        with self.model_lock:
+            boxes, confidences = detect_raw_boxes(model, image.preview, self.conf)
+        boxes = scale_boxes(boxes, image.full_size[0] / image.preview.width,
+                            image.full_size[1] / image.preview.height)
+        if self.cache is not None:
+            self.cache.put(image.path, boxes, confidences)
+        return boxes, confidences
+
+    def detect(self, image):
+        """余白を付けて正方形に補正し、画像内に収めた顔枠（元画像の座標）のリストを返す"""
+        boxes, confidences = self.detect_raw(image)
+        return expand_face_boxes(boxes, image.full_size, confidences, **self.box_options)
+
+    def crop_boxes(self, face_boxes, mode="all"):
+        return select_boxes(face_boxes, mode)
+
+    def job(self, path, box, output_path, preset=None, encoder=None):
+        """保存キューに投入するジョブ（preset / encoder を省略するとこの Cropper の設定）"""
+        return make_job(path, box, output_path, self.output_size, pipeline=self.pipeline,
+                        preset=preset or self.preset, encoder=encoder or self.encoder)
+
+    def output_job(self, path, box, output_dir, suffix="", preset=None, encoder=None):
+        """output_dir に元画像の名前から決めた出力パスで保存するジョブ"""
+        encoder = encoder or self.encoder
+        return self.job(path, box, os.path.join(output_dir, output_name(path, suffix, extension(encoder))),
+                        preset, encoder)
+
+    def render(self, image, box):
+        """元の解像度で box の範囲を読み込み、出力サイズに仕上げた画像を返す（image はパスでもよい）"""
+        path = getattr(image, "path", image)
+        return render_region(self.job(path, box, None), load_region(path, box))
+
+    def render_all(self, image, boxes):
+        """複数の枠を1回のデコードで仕上げる"""
+        path = getattr(image, "path", image)
+        regions = load_regions(path, boxes)
+        return [render_region(self.job(path, box, None), region) for box, region in zip(boxes, regions)]
+
+    def encode(self, crop):
+        return encode(crop, self.encoder)
+
+    def save(self, crop, output_path):
+        """crop をエンコードして output_path に書く（一時ファイル経由）"""
+        write_atomic(output_path, self.encode(crop))
+        return output_path
+
+    def process(self, path, mode="all"):
+        """読み込み・検出・クロップをまとめて行い、Crop のリストを返す"""
+        image = self.load(path)
+        boxes = self.crop_boxes(self.detect(image), mode)
+        return [Crop(box, crop) for box, crop in zip(boxes, self.render_all(image, boxes))]
+
+
+class AsyncCropper:
+    """Cropper の処理を executor で実行する asyncio 用のインターフェース
+
+    executor を省略すると concurrency 本のスレッドプールを作り、close（async with の終了時）で閉じる。
+    """
+
+    def __init__(self, cropper, executor=None, concurrency=DEFAULT_CONCURRENCY):
+        self.cropper = cropper
+        self.concurrency = concurrency
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(concurrency, thread_name_prefix="crop")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def load(self, path):
+        return await self._run(self.cropper.load, path)
+
+    async def detect(self, image):
+        return await self._run(self.cropper.detect, image)
+
+    async def render(self, image, box):
+        return await self._run(self.cropper.render, image, box)
+
+    async def save(self, crop, output_path):
+        return await self._run(self.cropper.save, crop, output_path)
+
+    async def process(self, path, mode="all"):
+        """1枚を処理して CropResult を返す（失敗は例外を送出せず error に入れる）"""
+        try:
+            return CropResult(path, await self._run(self.cropper.process, path, mode), None)
+        except Exception as e:
+            return CropResult(path, [], e)
+
+    async def process_stream(self, paths, mode="all", concurrency=None):
+        """paths（非同期イテレータか通常のイテラブル）の画像を処理し、CropResult を入力の順に返す
+
+        同時に処理するのは concurrency 件まで。呼び出し側が結果を受け取るまで次の入力は取り出さないので、
+        入力が無限のストリームでも保持する画像は concurrency 件分に限られる。
+        """
+        concurrency = concurrency or self.concurrency
+        pending = deque()
+        try:
+            async for path in self._iterate(paths):
+                pending.append(asyncio.ensure_future(self.process(path, mode)))
+                if len(pending) >= concurrency:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _iterate(self, paths):
+        if hasattr(paths, "__aiter__"):
+            async for path in paths:
+                yield path
+            return
+        # 通常のイテレータ（フォルダの走査など）はイベントループを止めないよう executor で進める
+        iterator = iter(paths)
+        end = object()
+        while True:
+            path = await self._run(next, iterator, end)
+            if path is end:
+                return
+            yield path
+
+    def close(self):
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,182 @@
+"""顔検出器の実装（ultralytics / ONNX Runtime）
+
+どちらも同じインターフェースを持つ:
+    detect(image, conf)        画像1枚 → (boxes.xyxy のリスト, 信頼度のリスト)。座標は入力画像基準
+    detect_batch(arrays, conf) レターボックス済みの RGB 配列のリスト → 画像ごとの (xyxy, 信頼度)。
+                               座標はレターボックス画像基準
+    imgsz                      detect_batch に渡す配列の一辺
+    backend                    実装の名前（検出結果のキャッシュのキーに含める）
+
+ONNX 版は前処理・後処理（NMS を含む）を NumPy で行い、torch を import しない。
+モデルの書き出しと INT8 量子化（どちらも一度だけ行えばよい）:
+    python cropimage_backends.py export yolov11n-face.pt
+    python cropimage_backends.py quantize yolov11n-face.onnx yolov11n-face.int8.onnx [--calibration-dir IMAGES]
+"""
+import argparse
+import os
+
+import numpy as np
+from PIL import Image
+
+from cropimage_boxes import nms
+from cropimage_detect import letterbox, unletterbox_boxes
+
+DEFAULT_IMGSZ = 640
+NMS_IOU = 0.7  # ultralytics の既定値に合わせる
+MAX_DETECTIONS = 300
+# 使えるものを先頭から使う（OpenVINO 版の onnxruntime が入っていればそちらを優先）
+DEFAULT_PROVIDERS = ("OpenVINOExecutionProvider", "CPUExecutionProvider")
+
+
+class UltralyticsDetector:
+    """ultralytics.YOLO（.pt）による検出。torch が必要"""
+
+    backend = "ultralytics"
+
+    def __init__(self, model_path, imgsz=DEFAULT_IMGSZ):
+        from ultralytics import YOLO  # ここで初めて import する
+        self.model = YOLO(model_path)
+        self.imgsz = imgsz
+
+    def detect(self, image, conf):
+        results = self.model.predict(image, conf=conf, verbose=False)
+        if not results:
+            return [], []
+        return results[0].boxes.xyxy.tolist(), results[0].boxes.conf.tolist()
+
+    def detect_batch(self, arrays, conf):
+        # ultralytics は numpy 配列を BGR として扱う
+        sources = [np.ascontiguousarray(array[..., ::-1]) for array in arrays]
+        results = self.model.predict(sources, conf=conf, imgsz=self.imgsz, verbose=False)
+        return [(r.boxes.xyxy.tolist(), r.boxes.conf.tolist()) for r in results]
+
+
+class OnnxDetector:
+    """ONNX Runtime による検出（ultralytics で書き出した YOLO の .onnx）"""
+
+    backend = "onnxruntime"
+
+    def __init__(self, model_path, providers=DEFAULT_PROVIDERS, threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        available = ort.get_available_providers()
+        self.session = ort.InferenceSession(
+            model_path, options, providers=[p for p in providers if p in available] or available
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch, _, height, _ = model_input.shape
+        # 固定サイズで書き出したモデルはその大きさ、dynamic なら既定の 640
+        self.imgsz = height if isinstance(height, int) else DEFAULT_IMGSZ
+        self.fixed_batch = batch if isinstance(batch, int) else None
+
+    def detect(self, image, conf):
+        if isinstance(image, str):
+            image = Image.open(image)
+        array, ratio, pad = letterbox(image, self.imgsz)
+        boxes, confidences = self.detect_batch([array], conf)[0]
+        return unletterbox_boxes(boxes, ratio, pad), confidences
+
+    def detect_batch(self, arrays, conf):
+        if not arrays:
+            return []
+        if self.fixed_batch == 1 and len(arrays) > 1:
+            return [r for array in arrays for r in self.detect_batch([array], conf)]
+        # NHWC uint8 → NCHW float32 (0..1)
+        blob = np.stack(arrays).transpose(0, 3, 1, 2).astype(np.float32) / 255.0
+        output = self.session.run(None, {self.input_name: blob})[0]
+        return [postprocess(prediction, conf) for prediction in output]
+
+
+def postprocess(prediction, conf, iou=NMS_IOU, max_det=MAX_DETECTIONS):
+    """YOLO の出力1枚分 (4 + クラス数, アンカー数) を (xyxy, 信頼度) にする"""
+    prediction = prediction.T  # (アンカー数, 4 + クラス数)
+    scores = prediction[:, 4:].max(axis=1)
+    candidates = prediction[scores > conf]
+    scores = scores[scores > conf]
+    if not len(candidates):
+        return [], []
+    cx, cy, w, h = candidates[:, :4].T
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    # ultralytics と同じく信頼度の高い順に返す
+    keep = nms(boxes, scores, iou)[:max_det]
+    return boxes[keep].tolist(), scores[keep].tolist()
+
+
+def load_detector(model_path, **options):
+    """拡張子で実装を選ぶ（.onnx → ONNX Runtime、それ以外 → ultralytics）"""
+    if os.path.splitext(model_path)[1].lower() == ".onnx":
+        return OnnxDetector(model_path, **options)
+    return UltralyticsDetector(model_path, **options)
+
+
+def export_onnx(pt_path, imgsz=DEFAULT_IMGSZ):
+    """.pt を ONNX に書き出す（バッチ数は可変。ultralytics と torch が必要）"""
+    from ultralytics import YOLO
+    return YOLO(pt_path).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+
+
+class _CalibrationReader:
+    """静的量子化用にフォルダ内の画像をレターボックス化して渡す"""
+
+    def __init__(self, input_name, image_dir, imgsz, limit=100):
+        from cropimage_scan import iter_images
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self.paths = iter(list(iter_images(image_dir))[:limit])
+
+    def get_next(self):
+        for path in self.paths:
+            try:
+                with Image.open(path) as image:
+                    array, _, _ = letterbox(image, self.imgsz)
+            except OSError:
+                continue
+            return {self.input_name: array.transpose(2, 0, 1)[None].astype(np.float32) / 255.0}
+        return None
+
+
+def quantize_int8(onnx_path, output_path, calibration_dir=None, imgsz=DEFAULT_IMGSZ):
+    """INT8 に量子化する
+
+    calibration_dir を渡すとその画像で静的量子化（畳み込みも INT8 になり CPU で速い）、
+    無ければ重みだけの動的量子化を行う。
+    """
+    from onnxruntime import quantization
+    if calibration_dir is None:
+        quantization.quantize_dynamic(onnx_path, output_path, weight_type=quantization.QuantType.QUInt8)
+        return output_path
+    import onnxruntime as ort
+    input_name = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    quantization.quantize_static(
+        onnx_path, output_path, _CalibrationReader(input_name, calibration_dir, imgsz),
+        quant_format=quantization.QuantFormat.QDQ,
+        activation_type=quantization.QuantType.QUInt8, weight_type=quantization.QuantType.QInt8,
+    )
+    return output_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export and quantize the face detector for ONNX Runtime.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("export", help="export a .pt model to ONNX (needs ultralytics)")
+    p.add_argument("model")
+    p.add_argument("--imgsz", type=int, default=DEFAULT_IMGSZ)
+    p = sub.add_parser("quantize", help="quantize an ONNX model to INT8")
+    p.add_argument("model")
+    p.add_argument("output")
+    p.add_argument("--calibration-dir", default=None, help="sample images for static quantization")
+    p.add_argument("--imgsz", type=int, default=DEFAULT_IMGSZ)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        print(f"Exported: {export_onnx(args.model, args.imgsz)}")
+    else:
+        print(f"Quantized: {quantize_int8(args.model, args.output, args.calibration_dir, args.imgsz)}")
+
+
+if __name__ == "__main__":
+    main()
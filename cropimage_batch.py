@@ -0,0 +1,245 @@
+"""顔検出クロップのヘッドレス一括処理（Tk 不要）
+
+使い方:
+    python cropimage_batch.py INPUT_DIR [--output output] [--mode all|first|largest]
+    python cropimage_batch.py VIDEO_FILE [--stride 2] [--detect-interval 5]   # 動画（opencv が必要）
+"""
+import argparse
+import os
+import time
+
+from cropimage_core import (
+    DEFAULT_CONF, DEFAULT_MODEL_PATH, DEFAULT_ONNX_MODEL_PATH, DEFAULT_PRESET, OUTPUT_SIZE, PRESETS,
+    default_model_path, load_model,
+)
+from cropimage_api import MODES, select_boxes
+from cropimage_boxes import DEFAULT_MERGE_IOU, DEFAULT_MIN_FACE_SIZE
+from cropimage_cache import DEFAULT_CACHE_PATH, DetectionCache
+from cropimage_dedup import AUDIT_NAME, DEFAULT_THRESHOLD, HASH_KINDS, Deduplicator
+from cropimage_detect import BatchFaceDetector
+from cropimage_scan import DEFAULT_TYPES, VIDEO_TYPES, iter_images, sniff_image_type
+from cropimage_output import DEFAULT_ENCODER, ENCODER_PRESETS, SHARD_CONTAINERS, ShardWriter, extension, parse_encoder
+from cropimage_perf import PerfLog, add_arguments as add_perf_arguments, profile_from_args, timed_iter
+from cropimage_save import SaveQueue, make_job
+from cropimage_session import DONE, FAILED, MANIFEST_NAME, QUEUED, SKIPPED, SessionManifest, output_name
+from cropimage_source import (
+    MAP_LIMIT, MAX_SOURCE_PIXELS, MEMORY_LIMIT, clear_mapped_sources, frame_ref, remove_stale_mapped_sources,
+    set_limits,
+)
+from cropimage_video import (
+    DEFAULT_DETECT_INTERVAL, DEFAULT_SCENE_THRESHOLD, DEFAULT_STRIDE, VideoFaceDetector, frame_regions, iter_frames,
+)
+
+
+def process_folder(detector, save_queue, manifest, input_dir, output_dir, mode="all", output_size=OUTPUT_SIZE,
+                   recursive=False, preset=DEFAULT_PRESET, encoder=DEFAULT_ENCODER, dedup=None, videos=None,
+                   perf_log=None, profile=None):
+    """フォルダ内の未処理の画像を検出し、クロップを保存キューに投入した数を返す
+
+    videos にリストを渡すと、フォルダ内の動画のパスをそこに集める（処理は process_video で行う）。
+    perf_log には画像ごとの処理時間を記録し、profile（ProfileCapture）には処理順のインデックスを渡して
+    範囲を過ぎたら結果を書き出させる（範囲内のデコード・検出の計測は detector 側で行う）。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    # スキャンしながら検出を進める（一覧の完成を待たない）
+    types = DEFAULT_TYPES | VIDEO_TYPES if videos is not None else DEFAULT_TYPES
+    scan_timings = {}
+    paths = timed_iter(iter_images(input_dir, recursive, types), "scan", scan_timings)
+    if videos is not None:
+        paths = _split_videos(paths, videos, manifest)
+    if dedup is not None:
+        # 処理済みの画像も重複の代表として索引に入れる（除いてから索引を作ると、
+        # 前回残した画像の重複が再開時に別の画像として出力されてしまう）
+        paths = dedup.filter(paths)
+    paths = (p for p in paths if not manifest.is_done(p))
+    submitted = 0
+    for index, result in enumerate(detector.detect(paths)):
+        if profile is not None:
+            profile.on_image(index)
+        if perf_log is not None:
+            perf_log.record(result.path, "load", result.timings or {}, index=index, faces=len(result.face_boxes))
+        if result.error is not None:
+            # 読めなかった画像は処理済みにしない（再開時に読み直す）
+            manifest.append(result.path, FAILED)
+            continue
+        boxes = select_boxes(result.face_boxes, mode)
+        if not boxes:
+            manifest.append(result.path, SKIPPED)
+            continue
+        jobs = [
+            make_job(result.path, box,
+                     os.path.join(output_dir, output_name(result.path, f"_face{idx + 1}", extension(encoder))),
+                     output_size, pipeline="face", preset=preset, encoder=encoder)
+            for idx, box in enumerate(boxes)
+        ]
+        for job in jobs:
+            manifest.record_job(job, QUEUED)
+        # 1枚の画像の顔はまとめて1回のデコードで切り出す
+        save_queue.submit_group(jobs)
+        submitted += len(jobs)
+    if perf_log is not None:
+        perf_log.record(input_dir, "scan", scan_timings, count=0)
+    return submitted
+
+
+def _split_videos(paths, videos, manifest):
+    for path in paths:
+        if sniff_image_type(path) in VIDEO_TYPES:
+            if not manifest.is_done(path):
+                videos.append(path)
+        else:
+            yield path
+
+
+def process_video(detector, save_queue, manifest, video_path, frames, output_dir, mode="all",
+                  output_size=OUTPUT_SIZE, preset=DEFAULT_PRESET, encoder=DEFAULT_ENCODER):
+    """動画のフレームの顔をクロップして保存キューに投入した数を返す（フレームはディスクに書かない）"""
+    os.makedirs(output_dir, exist_ok=True)
+    submitted = 0
+    for result in detector.detect(frames):
+        boxes = select_boxes(result.face_boxes, mode)
+        if not boxes:
+            continue
+        index = result.frame.index
+        jobs = [
+            make_job(frame_ref(video_path, index), box,
+                     os.path.join(output_dir, output_name(video_path, f"_f{index:06d}_face{idx + 1}",
+                                                          extension(encoder))),
+                     output_size, pipeline="face", preset=preset, encoder=encoder)
+            for idx, box in enumerate(boxes)
+        ]
+        for job in jobs:
+            manifest.record_job(job, QUEUED)
+        # ワーカーには切り出したクロップ範囲だけを渡す
+        save_queue.submit_group(jobs, frame_regions(result.frame, boxes))
+        submitted += len(jobs)
+    # 動画全体を処理済みにする（未完了のクロップはフレームの参照から再出力される）
+    manifest.append(video_path, DONE)
+    return submitted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crop detected faces from every image in a folder.")
+    parser.add_argument("input_dir", help="image folder or video file")
+    parser.add_argument("--output", default="output", help="output directory (default: output)")
+    parser.add_argument("--mode", choices=MODES, default="all",
+                        help="crop every face, the first face, or the largest face per image")
+    parser.add_argument("--recursive", action="store_true", help="include images in subfolders")
+    parser.add_argument("--model", default=None,
+                        help=".onnx (ONNX Runtime) or .pt (ultralytics) model "
+                             f"(default: {os.path.basename(DEFAULT_ONNX_MODEL_PATH)} if present, "
+                             f"else {os.path.basename(DEFAULT_MODEL_PATH)})")
+    parser.add_argument("--conf", type=float, default=DEFAULT_CONF)
+    parser.add_argument("--size", type=int, default=OUTPUT_SIZE, help="output size in pixels")
+    parser.add_argument("--preset", choices=PRESETS, default=DEFAULT_PRESET,
+                        help="output quality: fast, balanced, or quality (DETAIL -> LANCZOS -> DETAIL)")
+    parser.add_argument("--format", choices=ENCODER_PRESETS, default="png",
+                        help="output format (png-fast = PNG compress level 1, npy = uncompressed NumPy array)")
+    parser.add_argument("--quality", type=int, default=None, help="JPEG/WebP quality (WebP 100 = lossless)")
+    parser.add_argument("--compress-level", type=int, default=None, help="PNG compress level 0-9")
+    parser.add_argument("--shard", choices=SHARD_CONTAINERS, default=None,
+                        help="pack crops into tar (WebDataset) or npz (with --format npy) archives")
+    parser.add_argument("--shard-size", type=int, default=1000, help="crops per shard")
+    parser.add_argument("--merge-iou", type=float, default=DEFAULT_MERGE_IOU,
+                        help="merge padded face boxes overlapping more than this IoU (negative: never merge)")
+    parser.add_argument("--min-face", type=int, default=DEFAULT_MIN_FACE_SIZE,
+                        help="ignore faces smaller than this many pixels (detected box height)")
+    parser.add_argument("--dedup", choices=HASH_KINDS, default=None,
+                        help="skip near-duplicate images using this perceptual hash (logged to duplicates.jsonl)")
+    parser.add_argument("--dedup-threshold", type=int, default=DEFAULT_THRESHOLD,
+                        help="max differing bits (of 64) for two images to count as duplicates")
+    parser.add_argument("--videos", action="store_true", help="also process video files found in the folder")
+    parser.add_argument("--stride", type=int, default=DEFAULT_STRIDE, help="video: process every Nth frame")
+    parser.add_argument("--min-change", type=float, default=0.0,
+                        help="video: skip frames differing less than this (mean abs, 0-255) from the last one")
+    parser.add_argument("--scene-threshold", type=float, default=DEFAULT_SCENE_THRESHOLD,
+                        help="video: frame difference treated as a scene cut (forces detection)")
+    parser.add_argument("--detect-interval", type=int, default=DEFAULT_DETECT_INTERVAL,
+                        help="video: run detection every N processed frames and track faces in between")
+    parser.add_argument("--batch-size", type=int, default=16, help="images per detection forward pass")
+    parser.add_argument("--imgsz", type=int, default=None, help="detection input size (default: the model's, 640)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="detection cache database")
+    parser.add_argument("--no-cache", action="store_true", help="always run detection")
+    parser.add_argument("--workers", type=int, default=None, help="save worker processes (default: all cores)")
+    parser.add_argument("--memory-limit", type=int, default=MEMORY_LIMIT // (1024 * 1024),
+                        help="decode larger images through a memory-mapped file (MB per image)")
+    parser.add_argument("--max-pixels", type=int, default=MAX_SOURCE_PIXELS,
+                        help="skip images with more pixels than this")
+    parser.add_argument("--map-limit", type=int, default=MAP_LIMIT // (1024 * 1024),
+                        help="total size of memory-mapped decode files to keep on disk (MB)")
+    add_perf_arguments(parser)
+    args = parser.parse_args(argv)
+    args.model = args.model or default_model_path()
+    encoder = ENCODER_PRESETS[args.format]
+    name = parse_encoder(encoder)[0]
+    if args.quality is not None and name in ("jpeg", "webp"):
+        encoder = f"{name}:{args.quality}"
+    if args.compress_level is not None and name == "png":
+        encoder = f"png:{args.compress_level}"
+    if args.shard == "npz" and name != "npy":
+        parser.error("--shard npz requires --format npy")
+    set_limits(args.memory_limit, args.max_pixels, args.map_limit)  # 保存ワーカーにも引き継ぐので先に設定する
+    remove_stale_mapped_sources()
+
+    model = load_model(args.model)
+    merge_iou = args.merge_iou if args.merge_iou >= 0 else None
+    imgsz = args.imgsz or model.imgsz
+    cache = None if args.no_cache else DetectionCache(args.cache, args.model, args.conf, imgsz, model.backend)
+    profile = profile_from_args(args)
+    detector = BatchFaceDetector(model, batch_size=args.batch_size, imgsz=imgsz, conf=args.conf, cache=cache,
+                                 merge_iou=merge_iou, min_face_size=args.min_face, profile=profile)
+    video_detector = VideoFaceDetector(model, batch_size=args.batch_size, imgsz=args.imgsz, conf=args.conf,
+                                       merge_iou=merge_iou, min_face_size=args.min_face)
+    workers = args.workers or os.cpu_count() or 1
+    os.makedirs(args.output, exist_ok=True)
+    manifest = SessionManifest(os.path.join(args.output, MANIFEST_NAME))
+    shard_writer = ShardWriter(args.output, args.shard, max_count=args.shard_size) if args.shard else None
+    perf_log = PerfLog(args.perf_log)
+    save_queue = SaveQueue(max_workers=workers, max_pending=workers * 4, shard_writer=shard_writer, perf_log=perf_log,
+                           on_done=lambda job, error: manifest.record_job(job, DONE if error is None else FAILED))
+    dedup = None
+    if args.dedup:
+        dedup = Deduplicator(args.dedup_threshold, args.dedup, audit_path=os.path.join(args.output, AUDIT_NAME))
+    start = time.perf_counter()
+    # 前回書き込みが完了しなかったクロップを先に再投入する
+    for job in manifest.interrupted_jobs():
+        save_queue.submit(job)
+    if os.path.isfile(args.input_dir):
+        videos = [args.input_dir]
+    else:
+        videos = [] if args.videos else None
+        process_folder(detector, save_queue, manifest, args.input_dir, args.output, args.mode, args.size,
+                       args.recursive, args.preset, encoder, dedup, videos, perf_log, profile)
+    for video_path in videos or ():
+        if manifest.is_done(video_path):
+            continue
+        # 中断した動画は、出力が記録されている最後のフレームの次から再開する
+        frames = iter_frames(video_path, args.stride, args.min_change, args.scene_threshold, args.detect_interval,
+                             start=manifest.resume_frame(video_path))
+        process_video(video_detector, save_queue, manifest, video_path, frames, args.output, args.mode, args.size,
+                      args.preset, encoder)
+    save_queue.close()
+    if profile is not None:
+        profile.finish()
+    perf_log.close()
+    manifest.close()
+    clear_mapped_sources()
+    elapsed = time.perf_counter() - start
+    print(f"Done: {save_queue.saved} crops saved to {args.output}, {save_queue.failed} failed")
+    print(f"Detection: {detector.images_processed} images, {detector.images_per_second:.1f} images/s "
+          f"(overall {detector.images_processed / elapsed if elapsed > 0 else 0.0:.1f} images/s)")
+    if perf_log.totals:
+        print(f"Stage totals: {perf_log.summary_text()}")
+    if video_detector.frames_detected:
+        print(f"Video: {video_detector.frames_detected + video_detector.frames_tracked} frames "
+              f"({video_detector.frames_detected} detected, {video_detector.frames_tracked} tracked)")
+    if dedup is not None:
+        dedup.close()
+        print(f"Duplicates: {dedup.duplicates} new images skipped (see {os.path.join(args.output, AUDIT_NAME)})")
+    if cache is not None:
+        print(f"Detection cache: {cache.hits} hits, {cache.misses} misses")
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
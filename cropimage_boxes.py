@@ -0,0 +1,73 @@
+"""顔枠の後処理（NumPy でまとめて計算する）
+
+検出枠 (N, 4) の xyxy 配列に対して、小さすぎる顔の除外・余白付け・正方形補正・
+画像内への補正・重なった枠の統合（NMS）を一括で行う。
+"""
+import numpy as np
+
+DEFAULT_MERGE_IOU = 0.6  # 余白付け後の枠がこれ以上重なる場合は信頼度の高いほうだけ残す
+DEFAULT_MIN_FACE_SIZE = 0  # 検出枠の高さがこれ未満（元画像の px）の顔は捨てる（0 は無効）
+
+
+def as_box_array(boxes):
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def pad_and_square(boxes):
+    """顔の高さの 0.3 倍の余白（左と上はその 1.8 倍）を付けて正方形に補正する"""
+    x1, y1, x2, y2 = boxes.T
+    padding = (y2 - y1) * 0.3
+    x1 = x1 - padding * 1.8
+    y1 = y1 - padding * 1.8
+    x2 = x2 + padding
+    y2 = y2 + padding
+    # 正方形に補正（長いほうに合わせる）
+    side = np.maximum(x2 - x1, y2 - y1)
+    return np.stack([x1, y1, x1 + side, y1 + side], axis=1)
+
+
+def clamp_boxes(boxes, image_size):
+    """正方形を保ったまま画像内に収まるよう平行移動する（画像より大きい枠は縮める）"""
+    width, height = image_size
+    side = np.minimum(boxes[:, 2] - boxes[:, 0], min(width, height))
+    x1 = np.clip(boxes[:, 0], 0, width - side)
+    y1 = np.clip(boxes[:, 1], 0, height - side)
+    return np.stack([x1, y1, x1 + side, y1 + side], axis=1)
+
+
+def nms(boxes, scores, iou_threshold):
+    """残す枠のインデックスをスコアの高い順に返す（重なりの大きい枠は除く）"""
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0])
+        h = np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1])
+        inter = np.clip(w, 0, None) * np.clip(h, 0, None)
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.intp)
+
+
+def postprocess_face_boxes(detections, image_size=None, confidences=None,
+                           merge_iou=DEFAULT_MERGE_IOU, min_face_size=DEFAULT_MIN_FACE_SIZE):
+    """boxes.xyxy を face_boxes 形式（余白付きの正方形）の配列に変換する
+
+    image_size を渡すと画像内に収まるよう補正する（渡さなければ従来どおりはみ出しを許す）。
+    merge_iou=None で統合しない。枠の順序は検出順のまま。
+    """
+    boxes = as_box_array(detections)
+    scores = (np.asarray(confidences, dtype=np.float64) if confidences is not None
+              else (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))
+    if min_face_size > 0:
+        large = boxes[:, 3] - boxes[:, 1] >= min_face_size
+        boxes, scores = boxes[large], scores[large]
+    boxes = pad_and_square(boxes)
+    if image_size is not None:
+        boxes = clamp_boxes(boxes, image_size)
+    if merge_iou is not None and len(boxes) > 1:
+        boxes = boxes[np.sort(nms(boxes, scores, merge_iou))]
+    return boxes
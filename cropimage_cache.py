@@ -0,0 +1,109 @@
+"""顔検出結果のディスクキャッシュ（SQLite）
+
+キーは「画像ファイル（パス+mtime+サイズ、または内容のハッシュ）」「モデルファイル」「conf」
+「検出の入力サイズ（imgsz）」「バックエンド」の組。
+値は元画像座標の boxes.xyxy と信頼度を float32 の配列として保存する。
+件数が上限を超えたら、最後に使われた時刻が古いものから削除する（LRU）。
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+DEFAULT_CACHE_PATH = os.path.join(os.getcwd(), "detection_cache.sqlite")
+DEFAULT_MAX_ENTRIES = 500_000
+EVICT_CHECK_INTERVAL = 1000  # 件数の確認（全件カウント）は put 1000 回ごと
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stat_key(path):
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}"
+
+
+class DetectionCache:
+    def __init__(self, db_path, model_path, conf, imgsz=None, backend=None, max_entries=DEFAULT_MAX_ENTRIES,
+                 content_hash=False):
+        # content_hash=True ならファイル内容で識別する（移動・コピーしてもヒットするが読み込みが必要）
+        # imgsz・backend は検出器の入力サイズと実装（どちらも結果が変わるのでキーに含める）
+        self.content_hash = content_hash
+        self.max_entries = max_entries
+        self.model_id = f"{file_digest(model_path)}|{conf:g}|{imgsz}|{backend}"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS detections ("
+            "key TEXT PRIMARY KEY, boxes BLOB NOT NULL, confidences BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS detections_last_used ON detections(last_used)")
+        self._evict()
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path):
+        source = file_digest(path) if self.content_hash else stat_key(path)
+        return hashlib.sha1(f"{source}|{self.model_id}".encode("utf-8")).hexdigest()
+
+    def get(self, path):
+        """キャッシュ済みなら (boxes, confidences) を、無ければ None を返す"""
+        try:
+            key = self.key(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT boxes, confidences FROM detections WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE detections SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        flat = array("f", row[0])
+        boxes = [tuple(flat[i:i + 4]) for i in range(0, len(flat), 4)]
+        return boxes, list(array("f", row[1]))
+
+    def put(self, path, boxes, confidences):
+        try:
+            key = self.key(path)
+        except OSError:
+            return
+        flat = array("f", [v for box in boxes for v in box])
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO detections (key, boxes, confidences, last_used) VALUES (?, ?, ?, ?)",
+                (key, flat.tobytes(), array("f", confidences).tobytes(), time.time()),
+            )
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= EVICT_CHECK_INTERVAL:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        self._puts_since_evict = 0
+        count = self._conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # 毎回削除しないよう、上限の 1 割ほど余分に空ける
+        excess = count - self.max_entries + max(1, self.max_entries // 10)
+        self._conn.execute(
+            "DELETE FROM detections WHERE key IN "
+            "(SELECT key FROM detections ORDER BY last_used LIMIT ?)", (excess,)
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,76 @@
+"""顔検出版 GUI のキャンバス上のアイテム（描画内容を保持するシーン）
+
+画像・顔枠（青枠とクリック判定用の枠）・選択枠（赤枠）・リサイズハンドルは一度だけ作り、
+再描画では canvas.coords / itemconfig で位置と表示状態だけを更新する。tag_bind も作成時の一度だけ。
+顔の数が変わったとき（次の画像に進んだときなど）だけ、足りない枠を作るか余った枠を消す。
+"""
+
+
+class FaceBoxScene:
+    def __init__(self, canvas, on_select, on_handle_press, on_handle_release, handle_size=10):
+        self.canvas = canvas
+        self.on_select = on_select  # on_select(顔のインデックス) 枠がクリックされたとき
+        self.handle_size = handle_size
+        self.image_item = None
+        self.face_items = []  # 顔ごとの (青枠, クリック判定用の枠)
+        self.highlight_item = canvas.create_rectangle(0, 0, 0, 0, outline="red", width=3, state="hidden",
+                                                      tags="highlight")
+        self.handle_items = []
+        for idx in range(4):  # 0:左上, 1:右上, 2:左下, 3:右下
+            tag = f"resize_handle_{idx}"
+            item = canvas.create_rectangle(0, 0, 0, 0, fill="red", outline="black", state="hidden", tags=tag)
+            canvas.tag_bind(tag, "<ButtonPress-1>", lambda event, i=idx: on_handle_press(i))
+            canvas.tag_bind(tag, "<ButtonRelease-1>", on_handle_release)
+            self.handle_items.append(item)
+
+    def set_image(self, tk_image, x, y):
+        """表示する画像と左上の位置（キャンバス座標）を設定する"""
+        if tk_image is None:
+            if self.image_item is not None:
+                self.canvas.itemconfig(self.image_item, state="hidden")
+            return
+        if self.image_item is None:
+            self.image_item = self.canvas.create_image(x, y, image=tk_image, anchor="nw", tags="image")
+            self.canvas.tag_lower(self.image_item)
+            return
+        if self.canvas.itemcget(self.image_item, "image") != str(tk_image):
+            self.canvas.itemconfig(self.image_item, image=tk_image)
+        self.canvas.itemconfig(self.image_item, state="normal")
+        self.canvas.coords(self.image_item, x, y)
+
+    def update(self, boxes, selected=None):
+        """boxes（キャンバス座標の顔枠）の位置に枠を移し、selected の枠に選択枠とハンドルを付ける"""
+        self._resize(len(boxes))
+        for (visual, clickable), box in zip(self.face_items, boxes):
+            self.canvas.coords(visual, *box)
+            self.canvas.coords(clickable, *box)
+        if selected is None:
+            self.canvas.itemconfig(self.highlight_item, state="hidden")
+            for item in self.handle_items:
+                self.canvas.itemconfig(item, state="hidden")
+            return
+        x1, y1, x2, y2 = boxes[selected]
+        self.canvas.coords(self.highlight_item, x1, y1, x2, y2)
+        self.canvas.itemconfig(self.highlight_item, state="normal")
+        size = self.handle_size
+        for item, (hx, hy) in zip(self.handle_items, ((x1, y1), (x2, y1), (x1, y2), (x2, y2))):
+            self.canvas.coords(item, hx - size, hy - size, hx + size, hy + size)
+            self.canvas.itemconfig(item, state="normal")
+
+    def _resize(self, count):
+        while len(self.face_items) > count:
+            idx = len(self.face_items) - 1
+            self.canvas.delete(*self.face_items.pop())
+            self.canvas.tag_unbind(f"clickable_{idx}", "<Button-1>")
+        if len(self.face_items) == count:
+            return
+        while len(self.face_items) < count:
+            idx = len(self.face_items)
+            visual = self.canvas.create_rectangle(0, 0, 0, 0, outline="blue", width=2, tags=f"visual_{idx}")
+            clickable = self.canvas.create_rectangle(0, 0, 0, 0, outline="", fill="", tags=f"clickable_{idx}")
+            self.canvas.tag_bind(f"clickable_{idx}", "<Button-1>", lambda event, i=idx: self.on_select(i))
+            self.face_items.append((visual, clickable))
+        # 新しく作った枠より選択枠とハンドルを手前にする
+        self.canvas.tag_raise(self.highlight_item)
+        for item in self.handle_items:
+            self.canvas.tag_raise(item)
@@ -0,0 +1,327 @@
+"""Tk に依存しないクロップ処理の共通部分
+
+GUI (cropimage_facedetect.py) とヘッドレス CLI (cropimage_batch.py) の両方から使う。
+"""
+import math
+import os
+from PIL import Image, ImageFilter
+
+from cropimage_perf import stage
+import cropimage_source
+from cropimage_source import decoded_bytes, exceeds_memory_limit, map_source, open_image, parse_frame_ref
+
+DEFAULT_MODEL_PATH = os.path.join(os.getcwd(), "yolov11n-face.pt")
+DEFAULT_ONNX_MODEL_PATH = os.path.join(os.getcwd(), "yolov11n-face.onnx")  # あればこちらを使う（torch 不要）
+DEFAULT_CONF = 0.3
+OUTPUT_SIZE = 1024
+PREVIEW_MAX_SIZE = 2048  # 表示・顔検出用のプレビューの長辺の上限
+# 出力の画質プリセット（quality は従来どおりの処理）
+PRESETS = ("fast", "balanced", "quality")
+DEFAULT_PRESET = "quality"
+
+
+def has_alpha(image):
+    """透過情報を持つ画像か（不透明な JPEG などは RGBA に変換しない）"""
+    return image.mode in ("RGBA", "LA", "PA", "RGBa", "La") or "transparency" in image.info
+
+
+def open_preview(image_path, max_size=PREVIEW_MAX_SIZE):
+    """表示・検出用の縮小画像と、元画像のサイズを返す
+
+    JPEG は draft により DCT 段階で縮小デコードする（1/2, 1/4, 1/8）。
+    それ以外は全体をデコードした後 reduce() で縮小し、大きな画像を保持しない。
+    縮小後の長辺は max_size 以下になる（reduce の倍率は切り上げ）。
+    デコード後のサイズがメモリ上限を超える画像は全体をメモリに置かずに縮小する（_reduce_large）。
+    """
+    with stage("decode"):
+        image = open_image(image_path)
+        full_size = image.size
+        alpha = has_alpha(image)
+        if image.format == "JPEG":
+            # draft は縦横とも要求サイズ以上に収まる範囲で縮小するので、縦横比を保った大きさを渡す
+            ratio = max_size / max(full_size)
+            if ratio < 1:
+                image.draft("RGB", (math.ceil(full_size[0] * ratio), math.ceil(full_size[1] * ratio)))
+        factor = -(-max(image.size) // max_size)
+        if exceeds_memory_limit(image):
+            image = _reduce_large(image_path, image, -(-max(full_size) // max_size))
+        elif factor >= 2:
+            image = image.reduce(factor)
+        else:
+            image.load()
+    with stage("convert"):
+        return image.convert("RGBA" if alpha else "RGB"), full_size
+
+
+def _reduce_large(image_path, image, factor):
+    """メモリ上限を超える画像を 1/factor に縮小する
+
+    部分デコードできる形式は行の帯ごとに読み込んで縮小し、それ以外はメモリマップから縮小する。
+    """
+    width, height = image.size
+    if _region_tiles(image, (0, 0, width, height)) is None:
+        return map_source(image_path).reduce(factor)
+    row_bytes = max(1, decoded_bytes(image) // height)
+    band = max(factor, cropimage_source.MEMORY_LIMIT // 4 // row_bytes // factor * factor)
+    preview = None
+    for top in range(0, height, band):
+        part = load_region(image_path, (0, top, width, min(height, top + band))).reduce(factor)
+        if preview is None:
+            preview = Image.new(part.mode, (-(-width // factor), -(-height // factor)))
+        preview.paste(part, (0, top // factor))
+    return preview
+
+
+_RAW_BYTES_PER_PIXEL = {"L": 1, "P": 1, "LA": 2, "RGB": 3, "RGBA": 4, "CMYK": 4}
+
+
+def _overlaps(extents, box):
+    x1, y1, x2, y2 = extents
+    return x1 < box[2] and box[0] < x2 and y1 < box[3] and box[1] < y2
+
+
+def _region_tiles(image, box):
+    """box の読み込みに必要なタイルだけを返す（部分デコードできない形式は None）
+
+    部分デコードできるのは、Pillow が複数のタイル／ストリップとして読む TIFF（非圧縮）と、
+    非圧縮で1つの領域に格納された画像（1ストリップの非圧縮 TIFF、BMP、PPM など）。
+    圧縮された TIFF は libtiff が1タイルとしてデコードするので対象外。
+    """
+    if len(image.tile) > 1:
+        return [t for t in image.tile if _overlaps(t[1], box)]
+    if len(image.tile) != 1:
+        return None
+    # 非圧縮（raw）で行ごとに格納されていれば、必要な行の帯だけを読む（BMP は下の行から格納される）
+    name, extents, offset, args = image.tile[0]
+    if isinstance(args, str):
+        args = (args, 0, 1)
+    if name != "raw" or tuple(extents) != (0, 0) + image.size or len(args) < 3:
+        return None
+    rawmode, stride, orientation = args[:3]
+    if orientation not in (1, -1) or (not stride and rawmode not in _RAW_BYTES_PER_PIXEL):
+        return None
+    stride = stride or image.width * _RAW_BYTES_PER_PIXEL[rawmode]
+    top = max(0, box[1])
+    bottom = min(image.height, box[3])
+    if bottom <= top:
+        return []
+    first_row = top if orientation == 1 else image.height - bottom  # 帯のうちファイル上で先に来る行
+    return [("raw", (0, top, image.width, bottom), offset + first_row * stride, (rawmode, stride, orientation))]
+
+
+def load_region(image_path, box):
+    """元の解像度で box の範囲を読み込む
+
+    非圧縮の TIFF・BMP・PPM などタイル（行）単位で位置が分かる画像は（_region_tiles）、
+    box と重なる部分だけをデコードする。それ以外は全体をデコードしてクロップする
+    （メモリ上限を超える画像はメモリマップにデコードし、そこから切り出す。マップできないモードは
+    SourceTooLargeError）。
+    動画のフレームの参照（frame_ref）ならそのフレームだけをデコードする。
+    """
+    if parse_frame_ref(image_path) is not None:
+        return load_regions(image_path, [box])[0]
+    with stage("decode"):
+        image, box, alpha = _decode_region(image_path, tuple(int(v) for v in box))
+    return crop_region(image, box, alpha)
+
+
+def _decode_region(image_path, box):
+    """load_region のデコード部分。(画像, 画像内の box, 透過の有無) を返す"""
+    image = open_image(image_path)
+    alpha = has_alpha(image)
+    tiles = _region_tiles(image, box)
+    if tiles:
+        left = min(t[1][0] for t in tiles)
+        top = min(t[1][1] for t in tiles)
+        right = max(t[1][2] for t in tiles)
+        bottom = max(t[1][3] for t in tiles)
+        # 重なるタイルの外接矩形だけを画像として読み込む
+        image.tile = [
+            (t[0], (t[1][0] - left, t[1][1] - top, t[1][2] - left, t[1][3] - top)) + tuple(t[2:])
+            for t in tiles
+        ]
+        image._size = (right - left, bottom - top)
+        if hasattr(image, "_tile_size"):  # TIFF はこちらのサイズで画像メモリを確保する
+            image._tile_size = image._size
+        image.load()
+        box = (box[0] - left, box[1] - top, box[2] - left, box[3] - top)
+    elif exceeds_memory_limit(image):
+        image = map_source(image_path)
+    else:
+        image.load()
+    return image, box, alpha
+
+
+def crop_region(image, box, alpha=None):
+    """デコード済みの image から box の範囲を切り出す"""
+    if alpha is None:
+        alpha = has_alpha(image)
+    width, height = image.size
+    if box[0] >= 0 and box[1] >= 0 and box[2] <= width and box[3] <= height and not alpha:
+        # 不透明な画像は RGBA に変換しない
+        with stage("crop"):
+            cropped = image.crop(box)
+        with stage("convert"):
+            return cropped.convert("RGB")
+    # 画像外にはみ出す部分は従来どおり透明で埋める（変換するのは box と重なる部分だけ）
+    with stage("crop"):
+        result = Image.new("RGBA", (box[2] - box[0], box[3] - box[1]), (0, 0, 0, 0))
+        overlap = (max(box[0], 0), max(box[1], 0), min(box[2], width), min(box[3], height))
+        if overlap[0] < overlap[2] and overlap[1] < overlap[3]:
+            result.paste(image.crop(overlap).convert("RGBA"), (overlap[0] - box[0], overlap[1] - box[1]))
+    return result
+
+
+def load_regions(image_path, boxes):
+    """複数の box を1回のデコードで読み込み、box ごとの画像を返す（load_region と同じ結果）
+
+    集合写真の全員分を切り出すときなど、同じ画像を何度もデコードしないために使う。
+    """
+    frame = parse_frame_ref(image_path)
+    if frame is not None:
+        from cropimage_video import read_frame  # opencv は動画を扱う場合のみ必要
+        with stage("decode"):
+            image = read_frame(*frame)
+        return [crop_region(image, tuple(int(v) for v in box), False) for box in boxes]
+    with open_image(image_path) as image:
+        full_width, full_height = image.size
+    boxes = [tuple(int(v) for v in box) for box in boxes]
+    if not boxes:
+        return []
+    # すべての box を含む範囲（画像内に制限）だけを読む
+    left = max(0, min(b[0] for b in boxes))
+    top = max(0, min(b[1] for b in boxes))
+    right = max(left, min(full_width, max(b[2] for b in boxes)))
+    bottom = max(top, min(full_height, max(b[3] for b in boxes)))
+    region = load_region(image_path, (left, top, right, bottom))
+    region_rgba = None
+    crops = []
+    with stage("crop"):
+        for box in boxes:
+            shifted = (box[0] - left, box[1] - top, box[2] - left, box[3] - top)
+            if box[0] >= 0 and box[1] >= 0 and box[2] <= full_width and box[3] <= full_height:
+                crops.append(region.crop(shifted))
+            else:
+                # 画像外にはみ出す部分は透明で埋める
+                if region_rgba is None:
+                    region_rgba = region.convert("RGBA")
+                crops.append(region_rgba.crop(shifted))
+    return crops
+
+
+def default_model_path():
+    """書き出し済みの ONNX モデルがあればそれを、無ければ .pt を使う"""
+    return DEFAULT_ONNX_MODEL_PATH if os.path.exists(DEFAULT_ONNX_MODEL_PATH) else DEFAULT_MODEL_PATH
+
+
+def load_model(model_path=None):
+    """顔検出器をロード（.onnx は ONNX Runtime、.pt は ultralytics。どちらもここで初めて import する）"""
+    model_path = model_path or default_model_path()
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found: {model_path}. Please place the YOLOv11 model in the current directory.")
+    from cropimage_backends import load_detector
+    return load_detector(model_path)
+
+
+def expand_face_boxes(detections, image_size=None, confidences=None, **options):
+    """boxes.xyxy のリストを face_boxes 形式に変換
+
+    計算は cropimage_boxes（NumPy）でまとめて行う。image_size を渡すと画像内に収め、
+    重なった枠の統合・小さい顔の除外は options（merge_iou, min_face_size）で調整する。
+    """
+    from cropimage_boxes import postprocess_face_boxes  # numpy は顔検出を使う場合のみ必要
+    boxes = postprocess_face_boxes(detections, image_size, confidences, **options)
+    return [tuple(box) for box in boxes.tolist()]
+
+
+def detect_raw_boxes(model, source, conf=DEFAULT_CONF):
+    """画像1枚の顔を検出し、(boxes.xyxy, 信頼度) のリストを返す"""
+    with stage("detect"):
+        return model.detect(source, conf)
+
+
+def scale_boxes(boxes, sx, sy):
+    return [(x1 * sx, y1 * sy, x2 * sx, y2 * sy) for x1, y1, x2, y2 in boxes]
+
+
+def detect_face_boxes(model, source, conf=DEFAULT_CONF, full_size=None):
+    """画像1枚の顔を検出し、face_boxes 形式で返す
+
+    source が縮小プレビューの場合は full_size を渡すと元画像の座標で返す。
+    """
+    detections, confidences = detect_raw_boxes(model, source, conf)
+    if full_size is not None:
+        detections = scale_boxes(detections, full_size[0] / source.width, full_size[1] / source.height)
+    return expand_face_boxes(detections, full_size, confidences)
+
+
+def box_area(box):
+    x1, y1, x2, y2 = box
+    return (x2 - x1) * (y2 - y1)
+
+
+def drop_opaque_alpha(image):
+    """アルファがすべて不透明なら RGB にする（以降のフィルタ・リサイズが 3/4 の量で済む）"""
+    if image.mode == "RGBA" and image.getextrema()[3][0] == 255:
+        return image.convert("RGB")
+    return image
+
+
+def _resample(image, output_size, preset):
+    """fast / balanced のリサイズ（大きく縮小する場合は reduce() で整数分の1にしてから補間する）"""
+    resample = Image.BILINEAR if preset == "fast" else Image.BICUBIC
+    return image.resize((output_size, output_size), resample, reducing_gap=2.0)
+
+
+def _final_sharpen(scale):
+    """出力サイズで1回だけかける 3x3 のシャープ化
+
+    DETAIL（中心 10/6、上下左右 -1/6）を2回かけた程度の強さにし、拡大した場合はやや強める。
+    """
+    k = 0.3 if scale > 1 else 0.2
+    return ImageFilter.Kernel((3, 3), (0, -k, 0, -k, 1 + 4 * k, -k, 0, -k, 0), scale=1)
+
+
+def render_crop(image, box, output_size=OUTPUT_SIZE, preset=DEFAULT_PRESET):
+    """クロップして LANCZOS で出力サイズにリサイズする（cropimage.py の処理）"""
+    cropped_image = _crop_box(image, box)
+    with stage("resize"):
+        if preset != "quality":
+            return _resample(cropped_image, output_size, preset)
+        return cropped_image.resize((output_size, output_size), Image.LANCZOS)
+
+
+def _crop_box(image, box):
+    x1, y1, x2, y2 = box
+    with stage("crop"):
+        return drop_opaque_alpha(image.crop((int(x1), int(y1), int(x2), int(y2))))
+
+
+def render_face_crop(image, box, output_size=OUTPUT_SIZE, preset=DEFAULT_PRESET):
+    """顔領域をクロップし DETAIL → LANCZOS → DETAIL で出力サイズに仕上げる
+
+    fast は BILINEAR でリサイズするだけ、balanced は BICUBIC でリサイズした後に
+    出力サイズで1回だけシャープ化する。
+    """
+    cropped_image = _crop_box(image, box)
+    if preset == "fast":
+        with stage("resize"):
+            return _resample(cropped_image, output_size, preset)
+    if preset == "balanced":
+        scale = output_size / max(1, cropped_image.width)
+        with stage("resize"):
+            resized_image = _resample(cropped_image, output_size, preset)
+        with stage("filter"):
+            return resized_image.filter(_final_sharpen(scale))
+
+    # 1. クロップ直後に DETAIL フィルタを適用して微細部をやや強調する
+    with stage("filter"):
+        detail_enhanced = cropped_image.filter(ImageFilter.DETAIL)
+
+    # 2. LANCZOS により固定サイズにリサイズ
+    with stage("resize"):
+        resized_image = detail_enhanced.resize((output_size, output_size), Image.LANCZOS)
+
+    # 3. リサイズ後にも軽く DETAIL フィルタを適用
+    with stage("filter"):
+        return resized_image.filter(ImageFilter.DETAIL)
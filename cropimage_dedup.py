@@ -0,0 +1,199 @@
+"""知覚ハッシュによる重複画像の除外
+
+縮小デコード（JPEG は draft で 1/8 まで）した画像から dHash または pHash（64 ビット）を計算し、
+ハミング距離がしきい値以下の画像を重複とみなす。近傍の検索は BK 木で行うので全ペアの比較は不要。
+フォルダのスキャンと並行して少しずつ処理でき、並び順で最初の画像を残して以降の重複を除く。
+除いた画像は、どの画像の重複とみなしたか（距離・ハッシュ）を監査用の JSONL に記録する
+（再開したときに同じ画像を記録し直さないよう、既に記録されている画像は書き足さない）。
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from PIL import Image
+
+from cropimage_core import open_preview
+
+HASH_KINDS = ("dhash", "phash")
+DEFAULT_HASH = "dhash"
+DEFAULT_THRESHOLD = 6  # 64 ビットのうち異なるビットがこの数以下なら重複
+HASH_DECODE_SIZE = 256  # ハッシュ計算用に縮小デコードする長辺
+AUDIT_NAME = "duplicates.jsonl"
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _to_bits(flags):
+    bits = 0
+    for flag in flags:
+        bits = bits << 1 | bool(flag)
+    return bits
+
+
+def dhash(image, hash_size=8):
+    """横に隣り合う画素の明暗の差（NumPy 不要）"""
+    pixels = list(image.convert("L").resize((hash_size + 1, hash_size), Image.BOX).getdata())
+    return _to_bits(
+        pixels[row * (hash_size + 1) + col] > pixels[row * (hash_size + 1) + col + 1]
+        for row in range(hash_size) for col in range(hash_size)
+    )
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(size):
+    import numpy as np
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def phash(image, hash_size=8, highfreq_factor=4):
+    """DCT の低周波成分が中央値より大きいか（再圧縮・色調補正に dHash より強い）"""
+    import numpy as np
+    size = hash_size * highfreq_factor
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.BOX), dtype=np.float64)
+    dct = _dct_matrix(size)
+    low = (dct @ pixels @ dct.T)[:hash_size, :hash_size].ravel()
+    return _to_bits(low > np.median(low[1:]))  # 直流成分は中央値から除く
+
+
+HASH_FUNCTIONS = {"dhash": dhash, "phash": phash}
+
+
+class BKTree:
+    """ハミング距離の BK 木（しきい値以内の近傍を全件比較せずに探す）"""
+
+    def __init__(self):
+        self._root = None  # [ハッシュ, item, {距離: 子ノード}]
+        self.size = 0
+
+    def add(self, value, item):
+        node = [value, item, {}]
+        self.size += 1
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value, radius):
+        """距離 radius 以内の (距離, item) を距離の近い順に返す"""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.append((distance, node[1]))
+            # 三角不等式により、子までの距離が distance ± radius の枝だけを調べればよい
+            stack.extend(child for d, child in node[2].items() if distance - radius <= d <= distance + radius)
+        return sorted(found, key=lambda r: r[0])
+
+
+def _read_audit_paths(audit_path):
+    """監査ログに記録済みの（前回までに除いた）画像のパス"""
+    paths = set()
+    try:
+        with open(audit_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    paths.add(json.loads(line)["path"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # 異常終了で途中までしか書かれなかった行
+    except FileNotFoundError:
+        pass
+    return paths
+
+
+class Deduplicator:
+    """画像のパスの列から近い重複を除く（スキャンと同じスレッドから使う）"""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, hash_kind=DEFAULT_HASH, workers=4, audit_path=None):
+        self.threshold = threshold
+        self.hash_kind = hash_kind
+        self.hash_fn = HASH_FUNCTIONS[hash_kind]
+        self.workers = workers
+        self.tree = BKTree()  # 残した画像（クラスタの代表）だけを入れる
+        self.duplicates = 0  # 今回新たに除いた画像の数（監査ログに記録済みのものは数えない）
+        self._lock = threading.Lock()
+        self._recorded = _read_audit_paths(audit_path) if audit_path else set()
+        self._audit = open(audit_path, "a", encoding="utf-8") if audit_path else None
+
+    def image_hash(self, path):
+        preview, _ = open_preview(path, HASH_DECODE_SIZE)
+        return self.hash_fn(preview)
+
+    def _hash_or_none(self, path):
+        try:
+            return self.image_hash(path)
+        except (OSError, ValueError):
+            return None  # 読めない画像は除かない（読み込み時に通常どおりエラーにする）
+
+    def check(self, path, value):
+        """重複なら残した画像のパスを返し、そうでなければ索引に加えて None を返す
+
+        代表とだけ比較するので、少しずつ変化する連続フレームが際限なく1つにまとまることはない。
+        """
+        matches = self.tree.search(value, self.threshold)
+        if not matches:
+            self.tree.add(value, path)
+            return None
+        distance, kept = matches[0]
+        if os.path.abspath(path) not in self._recorded:
+            self.duplicates += 1
+            self._record(path, kept, distance, value)
+        return kept
+
+    def filter(self, paths):
+        """paths から重複を除いて順に返すジェネレータ（ハッシュは workers 本のスレッドで先行して計算する）"""
+        executor = ThreadPoolExecutor(self.workers, thread_name_prefix="dedup")
+        pending = deque()
+        try:
+            for path in paths:
+                pending.append((path, executor.submit(self._hash_or_none, path)))
+                if len(pending) >= self.workers * 2:
+                    yield from self._resolve(*pending.popleft())
+            while pending:
+                yield from self._resolve(*pending.popleft())
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _resolve(self, path, future):
+        value = future.result()
+        if value is None or self.check(path, value) is None:
+            yield path
+
+    def _record(self, path, kept, distance, value):
+        if self._audit is None:
+            return
+        self._recorded.add(os.path.abspath(path))
+        record = {
+            "path": os.path.abspath(path),
+            "duplicate_of": os.path.abspath(kept),
+            "distance": distance,
+            "threshold": self.threshold,
+            "hash": f"{self.hash_kind}:{value:016x}",
+            "time": time.time(),
+        }
+        with self._lock:
+            self._audit.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._audit.flush()
+
+    def close(self):
+        with self._lock:
+            if self._audit is not None:
+                self._audit.close()
+                self._audit = None
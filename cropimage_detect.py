@@ -0,0 +1,145 @@
+"""バッチ単位で YOLO 推論を行う顔検出エンジン
+
+画像のデコードとレターボックス化をスレッドで先行させ、
+バッチごとに1回だけ検出器（cropimage_backends）の detect_batch を呼ぶ。
+"""
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from cropimage_boxes import DEFAULT_MERGE_IOU, DEFAULT_MIN_FACE_SIZE
+from cropimage_core import DEFAULT_CONF, expand_face_boxes, open_preview
+from cropimage_perf import collect, stage
+from cropimage_source import SourceTooLargeError, open_image
+
+# timings は段階ごとの処理時間（秒。検出時間はバッチの時間を枚数で割ったもの）
+# error はデコードに失敗したときの例外（検出なしとして返す）
+DetectionResult = namedtuple("DetectionResult", "path raw_boxes confidences face_boxes timings error",
+                             defaults=(None, None))
+
+LETTERBOX_COLOR = (114, 114, 114)
+
+
+def letterbox(image, size=640):
+    """縦横比を保ったまま size x size に収め、余白を灰色で埋める
+
+    戻り値は (RGB の uint8 配列, 縮小率, (左余白, 上余白))。
+    """
+    image = image.convert("RGB")
+    ratio = min(size / image.width, size / image.height)
+    new_w = max(1, round(image.width * ratio))
+    new_h = max(1, round(image.height * ratio))
+    pad_x = (size - new_w) // 2
+    pad_y = (size - new_h) // 2
+    canvas = Image.new("RGB", (size, size), LETTERBOX_COLOR)
+    canvas.paste(image.resize((new_w, new_h), Image.BILINEAR), (pad_x, pad_y))
+    return np.asarray(canvas), ratio, (pad_x, pad_y)
+
+
+def unletterbox_boxes(boxes, ratio, pad):
+    """レターボックス座標の xyxy を元画像の座標に戻す"""
+    pad_x, pad_y = pad
+    return [
+        ((x1 - pad_x) / ratio, (y1 - pad_y) / ratio, (x2 - pad_x) / ratio, (y2 - pad_y) / ratio)
+        for x1, y1, x2, y2 in boxes
+    ]
+
+
+class BatchFaceDetector:
+    def __init__(self, model, batch_size=16, imgsz=None, conf=DEFAULT_CONF, workers=4, cache=None,
+                 merge_iou=DEFAULT_MERGE_IOU, min_face_size=DEFAULT_MIN_FACE_SIZE, profile=None):
+        self.model = model
+        # ProfileCapture（範囲内の画像のデコードはデコードするスレッドで、推論はバッチごとに計測する）
+        self.profile = profile
+        self.cache = cache  # DetectionCache（ヒットした画像はデコードも推論もしない）
+        self.batch_size = batch_size
+        self.imgsz = imgsz or model.imgsz  # 固定サイズの ONNX モデルはその大きさに合わせる
+        self.conf = conf
+        self.workers = workers
+        # 顔枠の後処理（キャッシュには後処理前の検出枠を保存するので、変えても再推論は不要）
+        self.merge_iou = merge_iou
+        self.min_face_size = min_face_size
+        # スループット計測用（推論にかかった時間のみ）
+        self.images_processed = 0
+        self.elapsed = 0.0
+
+    @property
+    def images_per_second(self):
+        return self.images_processed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def _prepare(self, index, path):
+        """index 番目の画像のデコードとレターボックス化（ワーカースレッドで実行）
+
+        戻り値は (path, 元画像のサイズ, 配列, 縮小率, 余白, キャッシュ済みの検出結果, デコードのエラー, 段階ごとの時間)。
+        """
+        with self._capture(index), collect() as timings:
+            return self._decode(path) + (timings,)
+
+    def _capture(self, first, last=None):
+        return self.profile.capture(first, last) if self.profile is not None else nullcontext()
+
+    def _decode(self, path):
+        try:
+            cached = self.cache.get(path) if self.cache is not None else None
+            if cached is not None:
+                with open_image(path) as image:
+                    return path, image.size, None, None, None, cached, None
+            # 検出サイズ近くまで縮小して読む（JPEG は縮小デコード、巨大な画像も全体はメモリに置かない）
+            image, full_size = open_preview(path, self.imgsz)
+            with stage("convert"):
+                array, ratio, pad = letterbox(image, self.imgsz)
+            ratio *= image.width / full_size[0]  # 座標は元画像基準に戻す
+        except SourceTooLargeError as e:
+            print(f"Skipped: {e}")
+            return path, None, None, None, None, None, None
+        except OSError as e:
+            # 壊れたファイルやネットワーク越しの読み込みの失敗（再開時に読み直す）
+            print(f"Failed to decode {path}: {e}")
+            return path, None, None, None, None, None, e
+        return path, full_size, array, ratio, pad, None, None
+
+    def _predict(self, prepared):
+        """バッチ1つ分（キャッシュにない画像のみ）を1回の推論で処理"""
+        valid = [p for p in prepared if p[2] is not None]
+        outputs = {p[0]: p[5] for p in prepared if p[5] is not None}
+        if valid:
+            start = time.perf_counter()
+            results = self.model.detect_batch([p[2] for p in valid], self.conf)
+            share = (time.perf_counter() - start) / len(valid)
+            for (path, _, _, ratio, pad, _, _, timings), (boxes, confidences) in zip(valid, results):
+                timings["detect"] = share
+                outputs[path] = (unletterbox_boxes(boxes, ratio, pad), confidences)
+                if self.cache is not None:
+                    self.cache.put(path, *outputs[path])
+        for path, full_size, _, _, _, _, error, timings in prepared:
+            boxes, confidences = outputs.get(path, ([], []))
+            face_boxes = expand_face_boxes(boxes, full_size, confidences,
+                                           merge_iou=self.merge_iou, min_face_size=self.min_face_size)
+            yield DetectionResult(path, boxes, confidences, face_boxes, timings, error)
+
+    def detect(self, paths):
+        """paths の順に DetectionResult を返すジェネレータ
+
+        paths はイテレータでもよく、必要な分だけ読み進める。
+        次のバッチのデコードは現在のバッチの推論中に進めておく。
+        デコードできなかった画像は検出なしとし、error に例外を入れて返す。
+        """
+        paths = enumerate(paths)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = [pool.submit(self._prepare, i, p) for i, p in islice(paths, self.batch_size)]
+            first = 0
+            while pending:
+                prepared = [f.result() for f in pending]
+                pending = [pool.submit(self._prepare, i, p) for i, p in islice(paths, self.batch_size)]
+                start = time.perf_counter()
+                with self._capture(first, first + len(prepared) - 1):
+                    results = list(self._predict(prepared))
+                first += len(prepared)
+                self.elapsed += time.perf_counter() - start
+                self.images_processed += len(results)
+                yield from results
@@ -1,10 +1,26 @@
+import argparse
 import os
-from tkinter import Tk, Canvas, Button, Label, filedialog, Frame
-from PIL import Image, ImageTk
-from ultralytics import YOLO
+from functools import partial
+from tkinter import Tk, Canvas, Button, Label, Checkbutton, BooleanVar, OptionMenu, StringVar, filedialog, Frame
+from PIL import ImageTk
+
+from cropimage_core import DEFAULT_CONF, DEFAULT_PRESET, OUTPUT_SIZE, PRESETS, default_model_path, load_model, load_region
+from cropimage_api import Cropper, LoadedImage, scan_folder
+from cropimage_cache import DEFAULT_CACHE_PATH, DetectionCache
+from cropimage_canvas import FaceBoxScene
+from cropimage_prefetch import ImagePrefetcher
+from cropimage_render import DETAIL_POLL_MS, REFINE_DELAY_MS, ViewportRenderer
+from cropimage_output import ENCODER_PRESETS
+from cropimage_perf import PerfLog, add_arguments as add_perf_arguments, collect, profile_from_args
+from cropimage_save import SaveQueue, gui_worker_count
+from cropimage_session import DONE, FAILED, MANIFEST_NAME, QUEUED, SessionManifest
+from cropimage_source import SourceTooLargeError, clear_mapped_sources, remove_stale_mapped_sources
+from cropimage_view import (
+    center_box, contains, move_box, opposite_corner, resize_square, to_image_box, to_image_point, to_view_box,
+)
 
 class ImageCropperWithFaceDetection:
-    def __init__(self, root):
+    def __init__(self, root, perf_log_path=None, profile=None):
         self.root = root
         self.root.title("Accurate Crop Tool with Face Detection")
 
@@ -18,20 +34,42 @@ class ImageCropperWithFaceDetection:
         # ボタンとステータスラベル
         self.open_folder_btn = Button(self.control_frame, text="Open Folder", command=self.open_folder)
         self.save_btn = Button(self.control_frame, text="Crop & Save", command=self.crop_selected_face, state="disabled")
+        self.save_all_btn = Button(self.control_frame, text="Crop All Faces", command=self.crop_all_faces, state="disabled")
+        self.recursive_var = BooleanVar(value=False)  # サブフォルダも対象にするか
+        self.recursive_check = Checkbutton(self.control_frame, text="Include subfolders", variable=self.recursive_var, bg="white")
+        self.dedup_var = BooleanVar(value=False)  # 近い重複画像（知覚ハッシュ）を除くか
+        self.dedup_check = Checkbutton(self.control_frame, text="Skip duplicates", variable=self.dedup_var, bg="white")
+        self.preset_var = StringVar(value=DEFAULT_PRESET)  # 出力の画質プリセット
+        self.preset_menu = OptionMenu(self.control_frame, self.preset_var, *PRESETS)
+        self.format_var = StringVar(value="png")  # 出力形式
+        self.format_menu = OptionMenu(self.control_frame, self.format_var, "png", "png-fast", "jpeg", "webp")
         self.status_label = Label(self.control_frame, text="No folder selected", bg="white")
+        self.save_status_label = Label(self.control_frame, text="", bg="white")  # 保存キューの状況
 
         self.open_folder_btn.pack(side="left", padx=10)
         self.save_btn.pack(side="left", padx=10)
+        self.save_all_btn.pack(side="left", padx=10)
+        self.recursive_check.pack(side="left", padx=10)
+        self.dedup_check.pack(side="left", padx=10)
+        self.preset_menu.pack(side="left", padx=10)
+        self.format_menu.pack(side="left", padx=10)
         self.status_label.pack(side="left", padx=10)
+        self.save_status_label.pack(side="left", padx=10)
 
         # 属性
-        self.image_list = []
+        self.image_list = []  # スキャン中も伸び続ける
         self.current_image_index = 0
-        self.original_image = None
+        self.scanner = None  # バックグラウンドのフォルダスキャナー
+        self.waiting_for_image = False  # 次の画像がまだスキャンで見つかっていない間 True
+        self.original_image = None  # 表示・検出用の縮小プレビュー（元解像度のデコードは保存時のみ）
+        self.full_size = None  # 元画像のサイズ（座標はすべてこの解像度基準）
         self.tk_image = None
+        self.renderer = None  # 可視領域だけを描画するレンダラー
+        self.refine_job = None
+        self.detail_job = None  # 元画像の可視領域のバックグラウンド読み込みの完了を待つポーリング
         self.image_offset = [0, 0]
         self.scale = 1.0
-        self.output_size = 1024
+        self.output_size = OUTPUT_SIZE
         self.face_boxes = []  # 顔検出の座標リスト（画像内座標）
         self.selected_face_index = None
 
@@ -51,173 +89,241 @@ class ImageCropperWithFaceDetection:
         self.active_handle_index = None   # 0:左上, 1:右上, 2:左下, 3:右下
         self.fixed_point = None            # リサイズ中に固定する対角の点（画像内座標）
 
-        # YOLOモデルのロード
-        self.model_path = os.path.join(os.getcwd(), "yolov11n-face.pt")
-        if not os.path.exists(self.model_path):
-            raise FileNotFoundError(f"Model file not found: {self.model_path}. Please place the YOLOv11 model in the current directory.")
-        self.model = YOLO(self.model_path)
+        # キャンバスのアイテムは一度だけ作り、再描画では座標だけを更新する
+        self.scene = FaceBoxScene(self.canvas, self.select_face, self.start_resize, self.end_resize,
+                                  self.resize_handle_size)
+        # モーションイベントごとには描かず、アイドル時にまとめて1回描く
+        self.display_job = None
+        self.display_interactive = False
+
+        # YOLOモデルのロード（yolov11n-face.onnx があれば torch を使わない ONNX Runtime で推論）
+        self.model_path = default_model_path()
+        model = load_model(self.model_path)
+        # 一度検出した画像はフォルダを開き直しても推論しない
+        self.detection_cache = DetectionCache(DEFAULT_CACHE_PATH, self.model_path, DEFAULT_CONF, model.imgsz,
+                                              model.backend)
+        # 読み込み・検出・保存ジョブの作成は UI に依存しない Cropper で行う
+        # （推論は Cropper が先読みスレッドとメインスレッドの間で直列化する）
+        self.cropper = Cropper(model=model, model_path=self.model_path, conf=DEFAULT_CONF,
+                               cache=self.detection_cache, output_size=self.output_size, pipeline="face")
+
+        # 段階ごとの処理時間（パスを指定したときだけ JSONL に書く）と、範囲を指定したプロファイル
+        self.perf_log = PerfLog(perf_log_path)
+        self.profile = profile
+        # 次の画像のデコードと顔検出をバックグラウンドで先に済ませておく
+        self.prefetcher = ImagePrefetcher(self.decode_and_detect, profile=profile)
+        # クロップ・リサイズ・保存はワーカープロセスで行う（異常終了したプロセスのメモリマップは先に消す）
+        remove_stale_mapped_sources()
+        self.save_queue = SaveQueue(max_workers=gui_worker_count(), on_done=self.on_save_done,
+                                    perf_log=self.perf_log)
+        # 作業状況の記録（出力フォルダの session.jsonl。最初にフォルダを開いたときに開く）
+        self.manifest = None
 
         # マウスイベントのバインド
         self.canvas.bind("<MouseWheel>", self.on_zoom)
         self.canvas.bind("<ButtonPress-1>", self.on_drag_start)
         self.canvas.bind("<B1-Motion>", self.on_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_mouse_release)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.poll_save_status()
 
     def open_folder(self):
-        """フォルダを選択し、最初の画像をロード"""
+        """フォルダを選択し、バックグラウンドでスキャンを開始する"""
         folder_path = filedialog.askdirectory()
         if folder_path:
-            self.image_list = [
-                os.path.join(folder_path, f)
-                for f in os.listdir(folder_path)
-                if f.lower().endswith(('png', 'jpg', 'jpeg'))
-            ]
+            if self.scanner is not None:
+                self.scanner.cancel()
+            # image_list はスキャナーが追加していくリストそのもの
+            # 除いた重複は output/duplicates.jsonl に記録する（確認用）
+            self.scanner = scan_folder(folder_path, "output", recursive=self.recursive_var.get(),
+                                       dedup=self.dedup_var.get(), perf_log=self.perf_log)
+            self.open_manifest()
+            self.image_list = self.scanner.paths
+            self.prefetcher.reset(self.image_list)
             self.current_image_index = 0
-            if self.image_list:
-                os.makedirs("output", exist_ok=True)
+            self.waiting_for_image = True
+            self.set_save_state("disabled")
+            self.status_label.config(text="Scanning folder...")
+            self.scanner.start()
+            self.poll_scan(self.scanner)
+
+    def poll_scan(self, scanner):
+        """スキャンの進捗を表示し、最初の未処理画像が見つかったらロードする"""
+        if scanner is not self.scanner:
+            return  # 別のフォルダが開かれた
+        finished = scanner.finished
+        if self.waiting_for_image:
+            # クロップが完了していない最初の画像から再開する
+            self.current_image_index = self.manifest.next_unprocessed(self.image_list, self.current_image_index)
+            if self.current_image_index < len(self.image_list):
+                self.waiting_for_image = False
                 self.load_image()
                 self.update_ui(folder_loaded=True)
-            else:
+            elif finished:
+                self.waiting_for_image = False
                 self.update_ui(folder_loaded=False)
+                if self.image_list:
+                    self.status_label.config(text="All images processed!")
+                return
+        skipped = f" ({scanner.duplicates} duplicates skipped)" if scanner.duplicates else ""
+        if finished:
+            self.status_label.config(text=f"{len(self.image_list)} images loaded{skipped}.")
+        else:
+            self.status_label.config(text=f"{len(self.image_list)} images found{skipped}, scanning...")
+            self.root.after(100, self.poll_scan, scanner)
+
+    def open_manifest(self):
+        if self.manifest is not None:
+            return
+        self.manifest = SessionManifest(os.path.join("output", MANIFEST_NAME))
+        # 投入済みのまま書き込まれなかったクロップ（異常終了時など）を再投入する
+        for job in self.manifest.interrupted_jobs():
+            self.save_queue.submit(job)
 
     def update_ui(self, folder_loaded=False):
         if folder_loaded:
             self.status_label.config(text=f"{len(self.image_list)} images loaded.")
-            self.save_btn.config(state="normal" if self.face_boxes else "disabled")
+            self.set_save_state("normal" if self.face_boxes else "disabled")
         else:
             self.status_label.config(text="No folder selected")
-            self.save_btn.config(state="disabled")
+            self.set_save_state("disabled")
         self.root.update_idletasks()
 
+    def set_save_state(self, state):
+        self.save_btn.config(state=state)
+        self.save_all_btn.config(state=state)
+
+    def decode_and_detect(self, image_path):
+        """画像のデコードと顔検出（先読みスレッドで実行されるので Tk には触れない）"""
+        with collect() as timings:
+            image = self.cropper.load(image_path)
+            face_boxes = self.cropper.detect(image)
+        self.perf_log.record(image_path, "load", timings, faces=len(face_boxes))
+        return image, face_boxes
+
     def load_image(self):
         if self.current_image_index < len(self.image_list):
             image_path = self.image_list[self.current_image_index]
-            self.original_image = Image.open(image_path).convert("RGBA")
+            if self.profile is not None:
+                self.profile.on_image(self.current_image_index)
+            try:
+                image, face_boxes = self.prefetcher.get(self.current_image_index)
+            except SourceTooLargeError as e:
+                # 画素数の上限を超える画像は飛ばす
+                print(f"Skipped: {e}")
+                self.status_label.config(text=f"Skipped (too large): {os.path.basename(image_path)}")
+                self.next_image()
+                return
+            except OSError as e:
+                # 壊れたファイル・読めないファイルは FAILED を記録して次へ（再開時に読み直す）
+                print(f"Failed to decode {image_path}: {e}")
+                self.manifest.append(image_path, FAILED)
+                self.status_label.config(text=f"Failed to load: {os.path.basename(image_path)}")
+                self.next_image()
+                return
+            self.original_image, self.full_size = image.preview, image.full_size
+            if self.renderer is not None:
+                self.renderer.cancel()
+            # プレビューより細かく拡大したときは元画像の可視領域だけを読んで描く
+            # （読み込みはバックグラウンドで行い、届くまではプレビューを引き伸ばして表示する）
+            self.renderer = ViewportRenderer(self.original_image, self.full_size,
+                                             detail_loader=partial(load_region, image_path))
+            self.tk_image = None
             self.image_offset = [0, 0]
             self.scale = 1.0
-            self.detect_faces(image_path)
+            self.detect_faces(image_path, face_boxes)
         else:
             self.update_ui(folder_loaded=False)
 
-    def display_image(self):
+    def display_image(self, interactive=False):
+        """interactive=True は操作中の描画（高速な補間で描き、操作が止まったら LANCZOS で描き直す）"""
         if self.original_image is None:
             return
-        self.canvas.delete("all")
-        scaled_width = int(self.original_image.width * self.scale)
-        scaled_height = int(self.original_image.height * self.scale)
-        resized_image = self.original_image.resize((scaled_width, scaled_height), Image.LANCZOS)
-        self.tk_image = ImageTk.PhotoImage(resized_image)
-        self.canvas.create_image(
-            self.image_offset[0], self.image_offset[1],
-            image=self.tk_image, anchor="nw", tags="image"
-        )
-        # 顔検出枠の描画（青枠）
-        for idx, (x1, y1, x2, y2) in enumerate(self.face_boxes):
-            self.draw_face_box(idx, x1, y1, x2, y2)
-        # 選択領域（赤枠とリサイズハンドル）の描画
-        if self.selected_face_index is not None:
-            x1, y1, x2, y2 = self.face_boxes[self.selected_face_index]
-            self.canvas.create_rectangle(
-                x1 * self.scale + self.image_offset[0],
-                y1 * self.scale + self.image_offset[1],
-                x2 * self.scale + self.image_offset[0],
-                y2 * self.scale + self.image_offset[1],
-                outline="red", width=3, tags="highlight"
-            )
-            self.add_resize_handles(
-                x1 * self.scale + self.image_offset[0],
-                y1 * self.scale + self.image_offset[1],
-                x2 * self.scale + self.image_offset[0],
-                y2 * self.scale + self.image_offset[1]
-            )
-
-    def detect_faces(self, image_path):
-        """顔を検出してCanvasに描画"""
-        self.face_boxes = []
-        self.selected_face_index = None
-        self.display_image()  # 画像描画
+        view_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        # 倍率が変わったか可視領域が描画済み範囲を外れたときだけ画像を作り直す
+        if (self.tk_image is None
+                or not self.renderer.covers(self.scale, self.image_offset, view_size)
+                or (not interactive and self.renderer.rendered_fast)):
+            with collect() as timings:
+                rendered = self.renderer.render(self.scale, self.image_offset, view_size, fast=interactive)
+            self.tk_image = ImageTk.PhotoImage(rendered[0]) if rendered is not None else None
+            self.perf_log.record(self.image_list[self.current_image_index], "display", timings,
+                                 interactive=interactive)
+            if self.renderer.detail_pending:
+                self.schedule_detail_poll()
+        self.scene.set_image(self.tk_image, *self.renderer.placement(self.image_offset))
+        if interactive:
+            self.schedule_refine()
+        # 顔検出枠（青枠）と選択領域（赤枠とリサイズハンドル）は座標だけを更新する
+        self.scene.update([to_view_box(box, self.scale, self.image_offset) for box in self.face_boxes],
+                          self.selected_face_index)
+
+    def request_display(self, interactive=False):
+        """描画を予約する（連続したモーションイベントはアイドル時の1回の描画にまとめる）"""
+        if self.display_job is None:
+            self.display_interactive = interactive
+            self.display_job = self.root.after_idle(self.flush_display)
+        else:
+            # 1つでも確定後の描画が要求されていればそちらで描く
+            self.display_interactive = self.display_interactive and interactive
+
+    def flush_display(self):
+        self.display_job = None
+        self.display_image(interactive=self.display_interactive)
+
+    def schedule_refine(self):
+        """最後の操作から REFINE_DELAY_MS 後に LANCZOS で描き直す"""
+        if self.refine_job is not None:
+            self.root.after_cancel(self.refine_job)
+        self.refine_job = self.root.after(REFINE_DELAY_MS, self.refine)
+
+    def refine(self):
+        self.refine_job = None
+        if self.renderer is not None and self.renderer.rendered_fast:
+            self.display_image()
 
-        # 顔検出
-        results = self.model.predict(image_path, conf=0.3)
-        detections = results[0].boxes.xyxy.tolist() if results else []
+    def schedule_detail_poll(self):
+        if self.detail_job is None:
+            self.detail_job = self.root.after(DETAIL_POLL_MS, self.poll_detail)
 
-        if detections:
-            for idx, (x1, y1, x2, y2) in enumerate(detections):
-                face_height = y2 - y1
-                padding_top = face_height*0.3
-                padding_bottom = face_height*0.3
-                padding_sides = face_height*0.3
+    def poll_detail(self):
+        """元画像の可視領域が読み込まれたら描き直す"""
+        self.detail_job = None
+        if self.renderer is None or not self.renderer.detail_pending:
+            return
+        if self.renderer.detail_ready():
+            self.tk_image = None
+            self.display_image()
+        else:
+            self.schedule_detail_poll()
 
-                x1 -= padding_sides*1.8
-                y1 -= padding_top*1.8
-                x2 += padding_sides
-                y2 += padding_bottom
+    def detect_faces(self, image_path, face_boxes=None):
+        """顔を検出してCanvasに描画（先読み済みの face_boxes があれば推論は省略）"""
+        self.face_boxes = []
+        self.selected_face_index = None
 
-                # 正方形に補正（長いほうに合わせる）
-                side = max(x2 - x1, y2 - y1)
-                self.face_boxes.append((x1, y1, x1 + side, y1 + side))
-                self.draw_face_box(idx, x1, y1, x1 + side, y1 + side)
+        # 顔検出（キャッシュ・余白付け・正方形補正は Cropper 側）
+        if face_boxes is None:
+            face_boxes = self.cropper.detect(LoadedImage(image_path, self.original_image, self.full_size))
 
+        if face_boxes:
+            self.face_boxes = [tuple(box) for box in face_boxes]
             # 検出結果が1件のみなら自動的に選択状態にする
-            if len(detections) == 1:
+            if len(face_boxes) == 1:
                 self.selected_face_index = 0
-                # 選択状態となるように再描画
-                self.display_image()
         else:
             self.add_default_box()
-
-    def draw_face_box(self, idx, x1, y1, x2, y2):
-        x1_canvas = x1 * self.scale + self.image_offset[0]
-        y1_canvas = y1 * self.scale + self.image_offset[1]
-        x2_canvas = x2 * self.scale + self.image_offset[0]
-        y2_canvas = y2 * self.scale + self.image_offset[1]
-        self.canvas.create_rectangle(
-            x1_canvas, y1_canvas, x2_canvas, y2_canvas,
-            outline="blue", width=2, tags=f"visual_{idx}"
-        )
-        self.canvas.create_rectangle(
-            x1_canvas, y1_canvas, x2_canvas, y2_canvas,
-            outline="", fill="", tags=f"clickable_{idx}"
-        )
-        self.canvas.tag_bind(f"clickable_{idx}", "<Button-1>", lambda event, i=idx: self.select_face(i))
+        self.display_image()
 
     def add_default_box(self):
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
-        # デフォルトは正方形 512x512
-        x1_canvas = (canvas_width - 512) // 2
-        y1_canvas = (canvas_height - 512) // 2
-        x2_canvas = x1_canvas + 512
-        y2_canvas = y1_canvas + 512
-        # ※ここでは画面上のキャンバス座標をそのまま画像内座標とする（scale=1, offset=0想定）
-        self.face_boxes = [(x1_canvas, y1_canvas, x2_canvas, y2_canvas)]
+        # デフォルトは表示の中央の正方形 512x512（を画像内座標にしたもの）
+        view_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        self.face_boxes = [to_image_box(center_box(view_size, 512), self.scale, self.image_offset)]
         self.selected_face_index = 0
-        self.canvas.create_rectangle(
-            x1_canvas, y1_canvas, x2_canvas, y2_canvas,
-            outline="red", width=3, tags="default"
-        )
-        self.canvas.tag_bind("default", "<Button-1>", lambda event: self.select_face(0))
 
     def select_face(self, index):
         self.selected_face_index = index
-        self.display_image()
-
-    def add_resize_handles(self, x1, y1, x2, y2):
-        handle_size = self.resize_handle_size
-        handles = [
-            (x1, y1),  # 左上: handle_index=0
-            (x2, y1),  # 右上: handle_index=1
-            (x1, y2),  # 左下: handle_index=2
-            (x2, y2)   # 右下: handle_index=3
-        ]
-        for idx, (hx, hy) in enumerate(handles):
-            tag = f"resize_handle_{idx}"
-            self.canvas.create_rectangle(
-                hx - handle_size, hy - handle_size, hx + handle_size, hy + handle_size,
-                fill="red", outline="black", tags=tag
-            )
-            self.canvas.tag_bind(tag, "<ButtonPress-1>", lambda event, i=idx: self.start_resize(i))
-            self.canvas.tag_bind(tag, "<ButtonRelease-1>", self.end_resize)
+        self.request_display()
 
     def start_resize(self, handle_index):
         """リサイズ開始時に、操作しているハンドルに対し対角の固定点を記録する"""
@@ -225,16 +331,8 @@ class ImageCropperWithFaceDetection:
             return
         self.is_resizing = True
         self.active_handle_index = handle_index
-        # 現在の枠（画像内座標）
-        x1, y1, x2, y2 = self.face_boxes[self.selected_face_index]
-        if handle_index == 0:        # 左上を操作 → 右下固定
-            self.fixed_point = (x2, y2)
-        elif handle_index == 1:      # 右上を操作 → 左下固定
-            self.fixed_point = (x1, y2)
-        elif handle_index == 2:      # 左下を操作 → 右上固定
-            self.fixed_point = (x2, y1)
-        elif handle_index == 3:      # 右下を操作 → 左上固定
-            self.fixed_point = (x1, y1)
+        # 操作しているハンドルの対角（画像内座標）を固定する
+        self.fixed_point = opposite_corner(self.face_boxes[self.selected_face_index], handle_index)
 
     def end_resize(self, event):
         self.is_resizing = False
@@ -244,18 +342,13 @@ class ImageCropperWithFaceDetection:
     def on_drag_start(self, event):
         # まず、リサイズ操作中でなければ、クリック位置が赤い選択枠内かどうかチェック
         if not self.is_resizing and self.selected_face_index is not None:
-            x1, y1, x2, y2 = self.face_boxes[self.selected_face_index]
-            # キャンバス上での赤枠の座標
-            box_left = x1 * self.scale + self.image_offset[0]
-            box_top = y1 * self.scale + self.image_offset[1]
-            box_right = x2 * self.scale + self.image_offset[0]
-            box_bottom = y2 * self.scale + self.image_offset[1]
-            if box_left <= event.x <= box_right and box_top <= event.y <= box_bottom:
+            box = self.face_boxes[self.selected_face_index]
+            if contains(to_view_box(box, self.scale, self.image_offset), event.x, event.y):
                 # クリック位置が赤枠内部なら、クロップ枠移動モードにする
                 self.is_moving_crop = True
                 self.crop_drag_start_x = event.x
                 self.crop_drag_start_y = event.y
-                self.original_box_coords = (x1, y1, x2, y2)
+                self.original_box_coords = box
                 return  # ここで終了し、画像移動処理は行わない
 
         # リサイズ中以外の場合、通常は画像移動用のドラッグ開始
@@ -264,38 +357,19 @@ class ImageCropperWithFaceDetection:
 
     def on_drag(self, event):
         if self.is_resizing and self.active_handle_index is not None and self.selected_face_index is not None:
-            # リサイズ中の処理（正方形固定）
-            # 現在のマウス位置→画像内座標
-            current_img_x = (event.x - self.image_offset[0]) / self.scale
-            current_img_y = (event.y - self.image_offset[1]) / self.scale
-
-            fixed_x, fixed_y = self.fixed_point
-            # 固定点からの差分
-            dx = current_img_x - fixed_x
-            dy = current_img_y - fixed_y
-            side = max(abs(dx), abs(dy))
-            # 各軸の符号（固定点から見たドラッグの方向）を保持
-            new_x = fixed_x + (side if dx >= 0 else -side)
-            new_y = fixed_y + (side if dy >= 0 else -side)
-            # 新しい枠は固定点と新たな点の対角の矩形
-            x1_new = min(fixed_x, new_x)
-            y1_new = min(fixed_y, new_y)
-            x2_new = max(fixed_x, new_x)
-            y2_new = max(fixed_y, new_y)
-            # 最小サイズチェック
-            min_size = 20
-            if (x2_new - x1_new) < min_size or (y2_new - y1_new) < min_size:
+            # リサイズ中の処理（固定点とマウス位置を対角とする正方形）
+            point = to_image_point(event.x, event.y, self.scale, self.image_offset)
+            new_box = resize_square(self.fixed_point, point)
+            if new_box is None:  # 最小サイズ未満
                 return
-            self.face_boxes[self.selected_face_index] = (x1_new, y1_new, x2_new, y2_new)
-            self.display_image()
+            self.face_boxes[self.selected_face_index] = new_box
+            self.request_display(interactive=True)
         elif self.is_moving_crop and self.selected_face_index is not None:
             # クロップ枠移動中の場合
-            dx = (event.x - self.crop_drag_start_x) / self.scale  # 画像内座標での差分
-            dy = (event.y - self.crop_drag_start_y) / self.scale
-            orig_x1, orig_y1, orig_x2, orig_y2 = self.original_box_coords
-            new_coords = (orig_x1 + dx, orig_y1 + dy, orig_x2 + dx, orig_y2 + dy)
-            self.face_boxes[self.selected_face_index] = new_coords
-            self.display_image()
+            self.face_boxes[self.selected_face_index] = move_box(
+                self.original_box_coords, event.x - self.crop_drag_start_x, event.y - self.crop_drag_start_y,
+                self.scale)
+            self.request_display(interactive=True)
         else:
             # 画像移動処理
             dx = event.x - self.drag_start_x
@@ -304,7 +378,8 @@ class ImageCropperWithFaceDetection:
             self.image_offset[1] += dy
             self.drag_start_x = event.x
             self.drag_start_y = event.y
-            self.display_image()
+            # 描画済みの範囲内でのパンなら、画像は描き直さずアイテムの座標を更新するだけ
+            self.request_display(interactive=True)
 
     def on_mouse_release(self, event):
         if self.is_resizing:
@@ -316,41 +391,90 @@ class ImageCropperWithFaceDetection:
     def on_zoom(self, event):
         zoom_factor = 1.1 if event.delta > 0 else 0.9
         self.scale *= zoom_factor
-        self.display_image()
+        self.request_display(interactive=True)
 
     def crop_selected_face(self):
         """選択した顔領域をクロップし保存"""
         if self.selected_face_index is None or self.original_image is None:
             return
 
-        x1, y1, x2, y2 = self.face_boxes[self.selected_face_index]
-        cropped_image = self.original_image.crop((int(x1), int(y1), int(x2), int(y2)))
-        
-        # PIL の ImageFilter を使用（ファイル先頭に「from PIL import ImageFilter」がない場合は追加してください）
-        from PIL import ImageFilter
-
-        # 1. クロップ直後に DETAIL フィルタを適用して微細部をやや強調する
-        detail_enhanced = cropped_image.filter(ImageFilter.DETAIL)
-        
-        # 2. LANCZOS により固定サイズにリサイズ
-        resized_image = detail_enhanced.resize((self.output_size, self.output_size), Image.LANCZOS)
-        
-        # 3. リサイズ後にも軽く DETAIL フィルタを適用（必要に応じて）
-        final_image = resized_image.filter(ImageFilter.DETAIL)
-        
-        output_path = os.path.join("output", f"cropped_{self.current_image_index + 1}.png")
-        final_image.save(output_path)
-        print(f"Saved: {output_path}")
-
-        # 次の画像へ
-        self.current_image_index += 1
+        # DETAIL → LANCZOS → DETAIL と保存はワーカープロセスで行い、すぐ次の画像へ進む
+        box = self.face_boxes[self.selected_face_index]
+        image_path = self.image_list[self.current_image_index]
+        job = self.make_output_job(image_path, box)
+        self.manifest.record_job(job, QUEUED)
+        self.save_queue.submit(job)
+        self.update_save_status()
+        self.next_image()
+
+    def crop_all_faces(self):
+        """すべての顔枠をクロップし保存（元画像のデコードは1回だけ）"""
+        if not self.face_boxes or self.original_image is None:
+            return
+
+        image_path = self.image_list[self.current_image_index]
+        jobs = [self.make_output_job(image_path, box, f"_face{idx + 1}") for idx, box in enumerate(self.face_boxes)]
+        for job in jobs:
+            self.manifest.record_job(job, QUEUED)
+        self.save_queue.submit_group(jobs)
+        self.update_save_status()
+        self.next_image()
+
+    def make_output_job(self, image_path, box, suffix=""):
+        """選択中の画質・出力形式で保存ジョブを作る"""
+        return self.cropper.output_job(image_path, box, "output", suffix, preset=self.preset_var.get(),
+                                      encoder=ENCODER_PRESETS[self.format_var.get()])
+
+    def next_image(self):
+        """次の未処理の画像へ"""
+        self.current_image_index = self.manifest.next_unprocessed(self.image_list, self.current_image_index + 1)
         if self.current_image_index < len(self.image_list):
             self.load_image()
+        elif not self.scanner.finished:
+            # 次の画像はスキャナーが見つけ次第 poll_scan でロードする
+            self.waiting_for_image = True
+            self.set_save_state("disabled")
         else:
             self.update_ui(folder_loaded=False)
 
+    def on_save_done(self, job, error):
+        """保存キューのスレッドから呼ばれる（マニフェストへの記録のみ）"""
+        if self.manifest is not None:
+            self.manifest.record_job(job, DONE if error is None else FAILED)
+
+    def update_save_status(self):
+        # 各キューの待ち件数と直近のスループット（ディスク・CPU のどちらが詰まっているかの目安）
+        self.save_status_label.config(
+            text=f"{self.save_queue.status_text()} | Prefetch: {self.prefetcher.pending} pending, "
+                 f"{self.perf_log.rate('load'):.1f} images/s"
+        )
+
+    def poll_save_status(self):
+        self.update_save_status()
+        self.root.after(500, self.poll_save_status)
+
+    def on_close(self):
+        if self.scanner is not None:
+            self.scanner.cancel()
+        self.prefetcher.shutdown()
+        # 未完了の書き込みをすべて終えてから終了する
+        self.save_status_label.config(text=f"Flushing {self.save_queue.pending} pending writes...")
+        self.root.update_idletasks()
+        self.save_queue.close()
+        if self.profile is not None:
+            self.profile.finish()
+        self.perf_log.close()
+        if self.manifest is not None:
+            self.manifest.close()
+        self.detection_cache.close()
+        clear_mapped_sources()
+        self.root.destroy()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="顔検出付きのクロップツール")
+    add_perf_arguments(parser)
+    args = parser.parse_args()
     root = Tk()
     root.geometry("1200x800")
-    app = ImageCropperWithFaceDetection(root)
+    app = ImageCropperWithFaceDetection(root, perf_log_path=args.perf_log, profile=profile_from_args(args))
     root.mainloop()
@@ -0,0 +1,149 @@
+"""出力のエンコードと書き込み
+
+エンコーダーは "形式:パラメータ" の文字列で指定する（プロセス間で受け渡し、マニフェストにも記録する）:
+    png[:圧縮レベル 0-9]   既定 6（Pillow の既定と同じ）。1 にすると数倍速く、ファイルは少し大きくなる
+    jpeg[:品質]            optimize 付き。既定 92。アルファは捨てる
+    webp[:品質]            既定 90。100 はロスレス
+    npy                    無圧縮の NumPy 配列（H x W x C, uint8）。学習データの取り込み用
+
+ファイルは一時ファイルに書いてから rename するので、途中で落ちても壊れたファイルは残らない。
+シャードモードでは多数のクロップを tar（WebDataset 形式）または npz（無圧縮 zip）にまとめる。
+"""
+import io
+import os
+import tarfile
+import threading
+import time
+import zipfile
+
+from cropimage_perf import stage
+
+ENCODER_PRESETS = {
+    "png": "png:6",
+    "png-fast": "png:1",
+    "jpeg": "jpeg:92",
+    "webp": "webp:90",
+    "npy": "npy",
+}
+DEFAULT_ENCODER = ENCODER_PRESETS["png"]
+EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp", "npy": ".npy"}
+_DEFAULT_PARAMS = {"png": 6, "jpeg": 92, "webp": 90, "npy": None}
+SHARD_CONTAINERS = ("tar", "npz")
+
+
+def parse_encoder(spec):
+    """"jpeg:90" → ("jpeg", 90)"""
+    name, _, param = spec.partition(":")
+    if name not in EXTENSIONS:
+        raise ValueError(f"Unknown output format: {spec}")
+    return name, int(param) if param else _DEFAULT_PARAMS[name]
+
+
+def extension(spec):
+    return EXTENSIONS[parse_encoder(spec)[0]]
+
+
+def encode(image, spec=DEFAULT_ENCODER):
+    """画像を spec の形式でエンコードしたバイト列を返す"""
+    name, param = parse_encoder(spec)
+    buffer = io.BytesIO()
+    with stage("encode"):
+        if name == "png":
+            image.save(buffer, "PNG", compress_level=param)
+        elif name == "jpeg":
+            image.convert("RGB").save(buffer, "JPEG", quality=param, optimize=True)
+        elif name == "webp":
+            image.save(buffer, "WEBP", quality=param, lossless=param >= 100, method=4)
+        else:
+            import numpy as np  # 学習データ用の出力のときだけ必要
+            np.save(buffer, np.asarray(image), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def write_atomic(path, data):
+    """一時ファイルに書いてから置き換える（同じ出力先に同時に書いても壊れない）"""
+    directory, name = os.path.split(path)
+    temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with stage("write"):
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def shard_key(output_path):
+    """シャード内のキー（WebDataset は最初の . 以降を拡張子とみなすので . を含めない）"""
+    return os.path.splitext(os.path.basename(output_path))[0].replace(".", "_")
+
+
+class ShardWriter:
+    """クロップを tar / npz のシャードにまとめて書く
+
+    書き込み中のシャードは .part で、一杯になるか close したときに rename して確定する。
+    add は確定したシャードに含まれるジョブのリストを返す（確定前に落ちたら未完了として再実行される）。
+    """
+
+    def __init__(self, output_dir, container="tar", prefix="crops", max_count=1000, max_bytes=1 << 30):
+        if container not in SHARD_CONTAINERS:
+            raise ValueError(f"Unknown shard container: {container}")
+        self.output_dir = output_dir
+        self.container = container
+        self.prefix = prefix
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._jobs = []
+        self._bytes = 0
+        # 再開時に既存のシャードを上書きしないよう、開始時刻を名前に含める
+        self._stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.shards = []  # 確定したシャードのパス
+
+    def _open(self):
+        name = f"{self.prefix}-{self._stamp}-{len(self.shards):06d}.{self.container}"
+        self._path = os.path.join(self.output_dir, name)
+        if self.container == "tar":
+            self._file = tarfile.open(self._path + ".part", "w")
+        else:
+            self._file = zipfile.ZipFile(self._path + ".part", "w", zipfile.ZIP_STORED)
+
+    def _add_member(self, name, data):
+        if self.container == "tar":
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            self._file.addfile(info, io.BytesIO(data))
+        else:
+            self._file.writestr(name, data)
+
+    def add(self, job, data, metadata=None):
+        with self._lock, stage("write"):
+            if self._file is None:
+                self._open()
+            key = shard_key(job.output_path)
+            self._add_member(key + extension(job.encoder), data)
+            if metadata is not None and self.container == "tar":
+                self._add_member(key + ".json", metadata)
+            self._jobs.append(job)
+            self._bytes += len(data)
+            if len(self._jobs) >= self.max_count or self._bytes >= self.max_bytes:
+                return self._finalize()
+        return []
+
+    def _finalize(self):
+        if self._file is None:
+            return []
+        self._file.close()
+        os.replace(self._path + ".part", self._path)
+        self.shards.append(self._path)
+        jobs, self._jobs, self._bytes, self._file = self._jobs, [], 0, None
+        return jobs
+
+    def close(self):
+        with self._lock:
+            return self._finalize()
@@ -0,0 +1,224 @@
+"""処理段階ごとの計測（構造化ログ・スループット・プロファイル）
+
+各段階（scan, decode, convert, detect, render, crop, filter, resize, encode, write）を
+with stage("decode"): のように囲んでおき、collect() の中で実行したときだけ時間を集める
+（collect の外では何もしないので、計測しないときの負荷はほとんどない）。
+集めた時間は PerfLog で画像ごと・処理の区切り（phase）ごとに JSONL へ1行ずつ書き出す:
+    {"time": ..., "image": "a.jpg", "phase": "load", "stages": {"decode": 12.3, "detect": 40.1}, "total_ms": 52.4}
+phase は load（デコード・検出）、display（表示の描画）、save（クロップ〜書き込み）、scan（フォルダ全体）。
+
+ProfileCapture は指定した範囲の画像のデコード・検出などを cProfile で計測し（処理するスレッドで
+with capture(index): として囲む。先読みスレッドでの処理も対象になる）、tracemalloc とあわせて
+範囲を過ぎたら結果をファイルに書き出す。
+"""
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+STAGES = ("scan", "decode", "convert", "detect", "render", "crop", "filter", "resize", "encode", "write")
+THROUGHPUT_WINDOW = 30.0  # スループットはこの秒数の移動窓で求める
+
+_local = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """with の中の処理時間を、このスレッドの記録先（collect）の name に加える"""
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def collect(timings=None):
+    """このスレッドで実行される stage の時間を timings（dict、秒）に集める"""
+    previous = getattr(_local, "timings", None)
+    _local.timings = timings if timings is not None else {}
+    try:
+        yield _local.timings
+    finally:
+        _local.timings = previous
+
+
+def timed_call(fn, *args):
+    """fn(*args) を計測しながら実行し (結果, 段階ごとの時間) を返す（ワーカープロセスでも使える）"""
+    with collect() as timings:
+        result = fn(*args)
+    return result, timings
+
+
+def timed_iter(iterable, name, timings):
+    """イテレータの次の要素を得るのにかかった時間を timings[name] に加えながら返す"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+        yield item
+
+
+class PerfLog:
+    """段階ごとの処理時間を JSONL に追記し、phase ごとの直近のスループットを求める
+
+    path=None ならファイルには書かず、スループットの集計だけを行う。
+    """
+
+    def __init__(self, path=None, window=THROUGHPUT_WINDOW):
+        self.path = path
+        self.window = window
+        self._lock = threading.Lock()
+        self._events = {}  # phase -> 完了時刻の deque
+        self.totals = {}  # 段階 -> 合計時間（秒）
+        self._started = time.monotonic()
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, image, phase, timings, count=1, **extra):
+        """image の phase の計測結果を記録する（count はまとめて処理した件数）"""
+        now = time.monotonic()
+        with self._lock:
+            events = self._events.setdefault(phase, deque())
+            events.extend([now] * count)
+            while events and events[0] < now - self.window:
+                events.popleft()
+            for name, seconds in timings.items():
+                self.totals[name] = self.totals.get(name, 0.0) + seconds
+            if self._file is None:
+                return
+            stages = {name: round(seconds * 1000, 3) for name, seconds in timings.items()}
+            record = {"time": time.time(), "image": image, "phase": phase, "stages": stages,
+                      "total_ms": round(sum(stages.values()), 3)}
+            record.update(extra)
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def rate(self, phase):
+        """phase の直近の件数/秒"""
+        now = time.monotonic()
+        with self._lock:
+            events = self._events.get(phase, ())
+            recent = sum(1 for t in events if t >= now - self.window)
+        elapsed = min(self.window, now - self._started)
+        return recent / elapsed if elapsed > 0 else 0.0
+
+    def summary_text(self):
+        """段階ごとの合計時間（多い順）。ワーカープロセスの時間は並列に進んだ分も足し合わせる"""
+        with self._lock:
+            totals = sorted(self.totals.items(), key=lambda item: -item[1])
+        return ", ".join(f"{name} {seconds:.1f}s" for name, seconds in totals)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def parse_range(text):
+    """"10:20" → (10, 20)（画像の処理順のインデックス、両端を含む）。"15" は (15, 15)"""
+    start, _, end = text.partition(":")
+    return int(start), int(end) if end else int(start)
+
+
+class ProfileCapture:
+    """画像のインデックスが [start, end] の処理だけを cProfile と tracemalloc で計測する
+
+    cProfile は有効にしたスレッドしか計測しないので、画像ごとの処理（先読みスレッドでのデコード・検出など）を
+    それを実行するスレッドで capture(index) で囲む。範囲内の処理は1つずつ計測する
+    （Python 3.12 以降の cProfile は同時に1つしか有効にできないため。計測中は並列度が下がる）。
+    結果は output_dir に profile_<start>-<end>.prof（pstats / snakeviz で読める、スレッドごとの計測を合算）と
+    memory_<start>-<end>.txt（確保したメモリの多い行の一覧）として書き出す。
+    """
+
+    def __init__(self, start, end, output_dir=".", memory=True, top=50):
+        self.start = start
+        self.end = end
+        self.output_dir = output_dir
+        self.memory = memory
+        self.top = top
+        self._lock = threading.Lock()
+        self._profiles = []
+        self.done = False
+
+    def in_range(self, first, last=None):
+        """[first, last] の画像が計測する範囲にかかるか"""
+        last = first if last is None else last
+        return not self.done and first <= self.end and self.start <= last
+
+    @contextmanager
+    def capture(self, first, last=None):
+        """with の中の処理を、画像 first〜last が範囲にかかれば呼び出したスレッドで計測する"""
+        if not self.in_range(first, last):
+            yield
+            return
+        with self._lock:
+            if self.done:
+                yield
+                return
+            if self.memory and not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                self._profiles.append(profile)
+
+    def on_image(self, index):
+        """画像の処理（表示・保存の投入など）を始めるたびに呼ぶ。範囲を過ぎたら結果を書き出す"""
+        if index > self.end:
+            self.finish()
+
+    def finish(self):
+        """計測した結果を書き出す（終了時にも呼ぶ）"""
+        with self._lock:
+            if self.done or not self._profiles:
+                return
+            self.done = True
+            profiles, self._profiles = self._profiles, []
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = f"{self.start}-{self.end}"
+        profile_path = os.path.join(self.output_dir, f"profile_{name}.prof")
+        pstats.Stats(*profiles).dump_stats(profile_path)
+        print(f"Profile written: {profile_path}")
+        if self.memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            memory_path = os.path.join(self.output_dir, f"memory_{name}.txt")
+            with open(memory_path, "w", encoding="utf-8") as f:
+                f.write(f"current {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB\n")
+                for stat in snapshot.statistics("lineno")[:self.top]:
+                    f.write(f"{stat}\n")
+            print(f"Memory profile written: {memory_path}")
+
+
+def add_arguments(parser):
+    """GUI・CLI 共通の計測用オプション"""
+    parser.add_argument("--perf-log", default=None, help="write per-image stage timings to this JSONL file")
+    parser.add_argument("--profile", type=parse_range, default=None, metavar="START:END",
+                        help="capture cProfile and tracemalloc while processing images START..END (0-based)")
+    parser.add_argument("--profile-dir", default="profile", help="where --profile writes its results")
+
+
+def profile_from_args(args):
+    return ProfileCapture(*args.profile, output_dir=args.profile_dir) if args.profile else None
@@ -0,0 +1,89 @@
+"""次に表示する画像を先読みするスレッドプール
+
+loader(path) の結果（デコード済み画像や顔検出結果）を先に N 枚分用意しておく。
+Tk のウィジェットには触れないので、結果の反映は呼び出し側（メインスレッド）で行う。
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def estimate_bytes(result):
+    """先読み結果のおおよそのメモリ使用量（PIL 画像を含むタプルを想定。入れ子のタプルもたどる）"""
+    if hasattr(result, "getbands") and hasattr(result, "size"):
+        return result.width * result.height * len(result.getbands())
+    if isinstance(result, tuple):  # LoadedImage などの namedtuple も含む
+        return sum(estimate_bytes(item) for item in result)
+    return 0
+
+
+class ImagePrefetcher:
+    def __init__(self, loader, depth=3, max_bytes=512 * 1024 * 1024, workers=2, sizeof=estimate_bytes,
+                 profile=None):
+        self.loader = loader
+        self.profile = profile  # ProfileCapture（範囲内の画像の読み込みを、読み込むスレッドで計測する）
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._futures = {}  # index -> Future
+        self._paths = []
+
+    def reset(self, paths):
+        """フォルダ変更時に呼ぶ。未着手の先読みは取り消し、結果は破棄する"""
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures = {}
+            self._paths = paths
+
+    def _resident_bytes(self):
+        total = 0
+        for future in self._futures.values():
+            if future.done() and not future.cancelled() and future.exception() is None:
+                total += self.sizeof(future.result())
+        return total
+
+    def schedule(self, index):
+        """index から depth 枚先までを先読みし、範囲外の結果は捨てる"""
+        with self._lock:
+            wanted = range(index, min(index + self.depth, len(self._paths)))
+            for i in list(self._futures):
+                if i not in wanted:
+                    self._futures.pop(i).cancel()
+            for i in wanted:
+                if i in self._futures:
+                    continue
+                # メモリ上限に達したら、それ以上先は読まない
+                if self._resident_bytes() >= self.max_bytes:
+                    break
+                self._futures[i] = self._pool.submit(self._load, i, self._paths[i])
+
+    @property
+    def pending(self):
+        """まだ読み込みが終わっていない先読みの数"""
+        with self._lock:
+            return sum(1 for future in self._futures.values() if not future.done())
+
+    def get(self, index):
+        """index の結果を返し、続く画像の先読みを始める
+
+        先読みが間に合っていない場合は完了を待ち、
+        スケジュールされていなければこのスレッドで読み込む。
+        """
+        with self._lock:
+            future = self._futures.pop(index, None)
+            path = self._paths[index]
+        result = future.result() if future is not None and not future.cancelled() else self._load(index, path)
+        self.schedule(index + 1)
+        return result
+
+    def _load(self, index, path):
+        if self.profile is None:
+            return self.loader(path)
+        with self.profile.capture(index):
+            return self.loader(path)
+
+    def shutdown(self):
+        self.reset([])
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,175 @@
+"""キャンバスの可視領域だけを描画するレンダラー
+
+元画像全体を毎回リサイズする代わりに、縮小ピラミッドから可視領域（＋余白）だけを
+切り出してリサイズする。操作中は BILINEAR、操作が止まったら LANCZOS で描き直す。
+プレビューより細かく拡大したときは、detail_loader で元画像の可視領域だけを読んで描く。
+元画像の読み込みは UI スレッドを止めないようバックグラウンドで行い、届くまではプレビューを引き伸ばして描く
+（detail_pending が True の間、呼び出し側は detail_ready() を見て描き直す）。
+"""
+import math
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from cropimage_perf import stage
+
+FAST_RESAMPLE = Image.BILINEAR
+QUALITY_RESAMPLE = Image.LANCZOS
+REFINE_DELAY_MS = 150  # 最後の操作からこの時間が経ったら LANCZOS で描き直す
+DETAIL_MIN_SCALE = 0.5  # これ以上拡大したら（プレビューが粗ければ）元画像から描く
+DETAIL_POLL_MS = 50  # 元画像の読み込みが終わったかを確認する間隔
+
+# 元画像の読み込みは1本のスレッドで順に行う（古い要求は始まる前なら取り消す）
+_detail_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detail")
+
+
+def _contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+
+class ViewportRenderer:
+    def __init__(self, image, size=None, margin=256, min_level_size=64, detail_loader=None):
+        # image は縮小プレビューでもよい。座標はすべて元画像のサイズ size 基準
+        self.size = size or image.size
+        # detail_loader(box) は元画像の box（画像内の整数座標）を読み込む関数（load_region など）
+        self.detail_loader = detail_loader
+        self.detail = None  # 直前に読み込んだ (box, 画像)
+        self._detail_request = None  # 読み込み中の (box, Future)
+        self.detail_pending = False  # 直前の描画が元画像の読み込み待ちでプレビューを引き伸ばしたものか
+        self.margin = margin  # パン用に可視領域の外側も描いておく幅（キャンバス座標）
+        self.min_level_size = min_level_size
+        self.levels = [image]  # levels[k] は 1/2**k に縮小した画像（必要になった時点で作る）
+        # 直前に描画した領域（画像内座標）と、そのときの倍率・画質
+        self.rendered_rect = None
+        self.rendered_scale = None
+        self.rendered_fast = False
+        self.rendered_origin = (0, 0)  # 描画した画像の左上（画像オフセットからの相対位置）
+
+    def level(self, k):
+        while len(self.levels) <= k:
+            prev = self.levels[-1]
+            if min(prev.size) // 2 < self.min_level_size:
+                break
+            self.levels.append(prev.reduce(2))
+        return self.levels[min(k, len(self.levels) - 1)]
+
+    def level_for_scale(self, scale):
+        """元画像からの縮小率が 1/scale を超えない最も小さいピラミッド段"""
+        base = self.size[0] / self.levels[0].width  # プレビュー自体の縮小率
+        if scale * base >= 1:
+            return 0
+        return int(math.floor(math.log2(1 / (scale * base))))
+
+    def visible_rect(self, scale, offset, view_size, margin=0):
+        """キャンバス上に見えている範囲を画像内座標で返す（見えなければ None）"""
+        width, height = self.size
+        left = max(0.0, (-margin - offset[0]) / scale)
+        top = max(0.0, (-margin - offset[1]) / scale)
+        right = min(float(width), (view_size[0] + margin - offset[0]) / scale)
+        bottom = min(float(height), (view_size[1] + margin - offset[1]) / scale)
+        if right <= left or bottom <= top:
+            return None
+        return (left, top, right, bottom)
+
+    def covers(self, scale, offset, view_size):
+        """直前の描画をずらすだけで現在の表示を賄えるか（純粋なパンの判定）"""
+        if self.rendered_rect is None or scale != self.rendered_scale:
+            return False
+        visible = self.visible_rect(scale, offset, view_size)
+        if visible is None:
+            return True
+        r = self.rendered_rect
+        return r[0] <= visible[0] and r[1] <= visible[1] and visible[2] <= r[2] and visible[3] <= r[3]
+
+    def placement(self, offset):
+        """直前に描画した画像を、現在のオフセットで置くべきキャンバス座標"""
+        return (offset[0] + self.rendered_origin[0], offset[1] + self.rendered_origin[1])
+
+    def render(self, scale, offset, view_size, fast=False):
+        """可視領域を描画し (画像, (キャンバス x, キャンバス y)) を返す。見えなければ None"""
+        with stage("render"):
+            return self._render(scale, offset, view_size, fast)
+
+    def _render(self, scale, offset, view_size, fast):
+        rect = self.visible_rect(scale, offset, view_size, self.margin)
+        self.rendered_rect = rect
+        self.rendered_scale = scale
+        self.rendered_fast = fast
+        self.detail_pending = False
+        if rect is None:
+            return None
+
+        # キャンバス上の整数ピクセル位置に揃える
+        x0 = math.floor(rect[0] * scale + offset[0])
+        y0 = math.floor(rect[1] * scale + offset[1])
+        x1 = math.ceil(rect[2] * scale + offset[0])
+        y1 = math.ceil(rect[3] * scale + offset[1])
+        if x1 <= x0 or y1 <= y0:
+            return None
+        self.rendered_origin = (x0 - offset[0], y0 - offset[1])
+
+        source = self.level(self.level_for_scale(scale))
+        fx = self.size[0] / source.width
+        fy = self.size[1] / source.height
+        box = (
+            max(0.0, (x0 - offset[0]) / scale / fx),
+            max(0.0, (y0 - offset[1]) / scale / fy),
+            min(float(source.width), (x1 - offset[0]) / scale / fx),
+            min(float(source.height), (y1 - offset[1]) / scale / fy),
+        )
+        if not fast and self.needs_detail(scale):
+            detail = self.render_detail((fx * box[0], fy * box[1], fx * box[2], fy * box[3]), (x1 - x0, y1 - y0))
+            if detail is not None:
+                return detail, (x0, y0)
+            self.detail_pending = True  # 届くまではプレビューから描く
+        resample = FAST_RESAMPLE if fast else QUALITY_RESAMPLE
+        return source.resize((x1 - x0, y1 - y0), resample, box=box), (x0, y0)
+
+    def needs_detail(self, scale):
+        """プレビューを2倍以上に引き伸ばして表示することになるか"""
+        base = self.size[0] / self.levels[0].width
+        return self.detail_loader is not None and scale >= DETAIL_MIN_SCALE and scale * base >= 2
+
+    def render_detail(self, rect, out_size):
+        """元画像の rect（画像内座標）を out_size に描く
+
+        読み込み済みの範囲に収まっていなければバックグラウンドでの読み込みを要求して None を返す。
+        """
+        box = (
+            math.floor(rect[0]), math.floor(rect[1]),
+            min(self.size[0], math.ceil(rect[2])), min(self.size[1], math.ceil(rect[3])),
+        )
+        self.detail_ready()
+        if self.detail_loader is None:
+            return None
+        if self.detail is None or not _contains(self.detail[0], box):
+            if self._detail_request is None or not _contains(self._detail_request[0], box):
+                if self._detail_request is not None:
+                    self._detail_request[1].cancel()
+                self._detail_request = (box, _detail_executor.submit(self.detail_loader, box))
+            return None
+        (left, top, _, _), region = self.detail
+        return region.resize(out_size, QUALITY_RESAMPLE,
+                             box=(rect[0] - left, rect[1] - top, rect[2] - left, rect[3] - top))
+
+    def detail_ready(self):
+        """要求した元画像の範囲が読み込み済みになっていれば取り込んで True を返す（UI スレッドから呼ぶ）"""
+        if self._detail_request is None or not self._detail_request[1].done():
+            return False
+        box, future = self._detail_request
+        self._detail_request = None
+        if future.cancelled():
+            return False
+        try:
+            self.detail = (box, future.result())
+        except (OSError, ValueError) as e:
+            # 読めなければプレビューのまま表示する（読み直しを繰り返さない）
+            print(f"Detail load failed: {e}")
+            self.detail_loader = None
+            return False
+        return True
+
+    def cancel(self):
+        """別の画像に移るときに、まだ始まっていない読み込みを取り消す"""
+        if self._detail_request is not None:
+            self._detail_request[1].cancel()
+            self._detail_request = None
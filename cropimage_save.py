@@ -0,0 +1,193 @@
+"""クロップ・リサイズ・エンコード・保存をプロセスプールで行う保存キュー
+
+UI スレッドはジョブを投入するだけで次の画像に進める。
+ワーカーは元画像のクロップ範囲を自分でデコードするため、大きな画像をプロセス間で受け渡さない。
+（動画のフレームのようにメモリ上にしかない画像は、切り出したクロップ範囲だけを渡す。）
+出力形式は cropimage_output のエンコーダー指定に従い、ファイルは一時ファイル経由で書く。
+シャードモードではワーカーはエンコードまでを行い、シャードへの追記はこのプロセスでまとめて行う。
+"""
+import json
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from cropimage_core import DEFAULT_PRESET, OUTPUT_SIZE, load_region, load_regions, render_crop, render_face_crop
+from cropimage_output import DEFAULT_ENCODER, encode, write_atomic
+from cropimage_perf import collect, timed_call
+
+SaveJob = namedtuple("SaveJob", "source_path box output_path output_size pipeline preset encoder")
+
+PIPELINES = {
+    "plain": render_crop,       # cropimage.py: crop → LANCZOS
+    "face": render_face_crop,   # cropimage_facedetect.py: crop → DETAIL → LANCZOS → DETAIL
+}
+
+
+def make_job(source_path, box, output_path, output_size=OUTPUT_SIZE, pipeline="face", preset=DEFAULT_PRESET,
+             encoder=DEFAULT_ENCODER):
+    return SaveJob(source_path, tuple(box), output_path, output_size, pipeline, preset, encoder)
+
+
+def render_region(job, region):
+    """切り出したクロップ範囲をジョブのパイプライン・プリセットで出力サイズに仕上げる"""
+    return PIPELINES[job.pipeline](region, (0, 0) + region.size, job.output_size, job.preset)
+
+
+def _render_and_write(job, region, write):
+    data = encode(render_region(job, region), job.encoder)
+    if not write:
+        return data
+    write_atomic(job.output_path, data)
+    return job.output_path
+
+
+def run_save_job(job, write=True):
+    """ワーカープロセスで実行される保存処理（write=False なら書かずにエンコード結果を返す）"""
+    # 元の解像度でのデコードはここ（クロップ範囲のみ）で初めて行う
+    region = load_region(job.source_path, job.box)
+    return _render_and_write(job, region, write)
+
+
+def run_save_group(jobs, write=True):
+    """同じ元画像のジョブをまとめて処理する（デコードは1回）
+
+    戻り値はジョブごとの (結果, エラー)。1件の失敗で他のクロップは止めない。
+    """
+    return run_region_group(jobs, load_regions(jobs[0].source_path, [job.box for job in jobs]), write)
+
+
+def run_region_group(jobs, regions, write=True):
+    """切り出し済みのクロップ範囲から保存する（run_save_group と同じ戻り値）"""
+    results = []
+    for job, region in zip(jobs, regions):
+        try:
+            results.append((_render_and_write(job, region, write), None))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+
+def job_metadata(job):
+    """シャードにクロップと一緒に入れるメタデータ（JSON）"""
+    return json.dumps({
+        "source": os.path.abspath(job.source_path),
+        "box": list(job.box),
+        "output_size": job.output_size,
+        "pipeline": job.pipeline,
+        "preset": job.preset,
+    }, ensure_ascii=False).encode("utf-8")
+
+
+def gui_worker_count():
+    """GUI 用のワーカー数（UI の応答性のため全コアは使わない）"""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+class SaveQueue:
+    def __init__(self, max_workers=None, max_pending=None, on_done=None, shard_writer=None, perf_log=None):
+        # max_workers=None は全コアを使う（ヘッドレス実行向け）
+        self._pool = ProcessPoolExecutor(max_workers=max_workers)
+        # ShardWriter を渡すとファイルを個別に書かずシャードにまとめる（完了はシャードの確定時）
+        self.shard_writer = shard_writer
+        self._cond = threading.Condition()
+        self.max_pending = max_pending
+        self.on_done = on_done  # on_done(job, error) 書き込み完了時（プールのスレッドから呼ばれる）
+        self.perf_log = perf_log  # PerfLog を渡すとワーカーでの段階ごとの処理時間を記録する
+        self.pending = 0
+        self.saved = 0
+        self.failed = 0
+        self.errors = []  # (出力パス, 例外)
+
+    def _reserve(self, count):
+        with self._cond:
+            while self.max_pending is not None and self.pending >= self.max_pending:
+                self._cond.wait()
+            self.pending += count
+
+    def submit(self, job):
+        """ジョブを投入する。max_pending を超える場合は空きが出るまで待つ"""
+        self._reserve(1)
+        future = self._pool.submit(timed_call, run_save_job, job, self.shard_writer is None)
+        future.add_done_callback(lambda f, job=job: self._on_job_done(job, f))
+
+    def submit_group(self, jobs, regions=None):
+        """同じ元画像の複数のクロップを1つのワーカーでまとめて処理する（全員分の書き出し用）
+
+        regions（切り出し済みの画像）を渡すとワーカーは元画像を読まない。
+        """
+        jobs = list(jobs)
+        if not jobs:
+            return
+        self._reserve(len(jobs))
+        if regions is None:
+            future = self._pool.submit(timed_call, run_save_group, jobs, self.shard_writer is None)
+        else:
+            future = self._pool.submit(timed_call, run_region_group, jobs, list(regions), self.shard_writer is None)
+        future.add_done_callback(lambda f, jobs=jobs: self._on_group_done(jobs, f))
+
+    def _on_job_done(self, job, future):
+        error = future.exception()
+        result, timings = (None, {}) if error is not None else future.result()
+        self._finish(job, result, error, timings)
+        self._log(jobs=[job], timings=timings)
+
+    def _on_group_done(self, jobs, future):
+        error = future.exception()
+        results, timings = ([(None, error)] * len(jobs), {}) if error is not None else future.result()
+        for job, (result, job_error) in zip(jobs, results):
+            self._finish(job, result, job_error, timings)
+        self._log(jobs, timings)
+
+    def _log(self, jobs, timings):
+        if self.perf_log is not None:
+            self.perf_log.record(jobs[0].source_path, "save", timings, count=len(jobs),
+                                 outputs=[job.output_path for job in jobs])
+
+    def _finish(self, job, result, error, timings=None):
+        completed = [job]
+        if error is None and self.shard_writer is not None:
+            try:
+                # シャードが確定した時点で、そこに入ったジョブをまとめて完了にする
+                with collect(timings):
+                    completed = self.shard_writer.add(job, result, job_metadata(job))
+            except OSError as e:
+                error = e
+        with self._cond:
+            self.pending -= 1
+            if error is None:
+                self._report_saved(completed)
+            else:
+                self.failed += 1
+                self.errors.append((job.output_path, error))
+                print(f"Failed: {job.output_path} ({error})")
+            self._cond.notify_all()
+        self._notify(completed if error is None else [job], error)
+
+    def _report_saved(self, jobs):
+        self.saved += len(jobs)
+        if self.shard_writer is None:
+            for job in jobs:
+                print(f"Saved: {job.output_path}")
+        elif jobs:
+            print(f"Saved: {self.shard_writer.shards[-1]} ({len(jobs)} crops)")
+
+    def _notify(self, jobs, error):
+        if self.on_done is not None:
+            for job in jobs:
+                self.on_done(job, error)
+
+    def status_text(self):
+        text = f"Writes: {self.pending} pending, {self.failed} failed"
+        if self.perf_log is not None:
+            text += f", {self.perf_log.rate('save'):.1f} crops/s"
+        return text
+
+    def close(self):
+        """未完了の書き込みをすべて完了させてからプールを閉じる（書き込み中のシャードも確定する）"""
+        self._pool.shutdown(wait=True)
+        if self.shard_writer is not None:
+            completed = self.shard_writer.close()
+            with self._cond:
+                self._report_saved(completed)
+            self._notify(completed, None)
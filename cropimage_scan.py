@@ -0,0 +1,115 @@
+"""大きなフォルダ向けの逐次スキャナー
+
+os.scandir でディレクトリを順に読み、見つかった画像をその場で返す。
+画像かどうかは拡張子ではなく先頭のマジックバイトで判定する（動画も判定できる）。
+並び順はディレクトリごとに名前順（ファイル → サブフォルダの順）で、毎回同じになる。
+"""
+import os
+import threading
+
+from cropimage_perf import timed_iter
+
+# 先頭バイト列 → 画像形式
+MAGIC_BYTES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"\x1a\x45\xdf\xa3", "mkv"),  # Matroska / WebM
+)
+DEFAULT_TYPES = frozenset({"png", "jpeg", "webp", "bmp", "tiff"})
+VIDEO_TYPES = frozenset({"mp4", "mkv", "avi"})
+# ISO BMFF のうち静止画（HEIF/AVIF）のブランド
+_IMAGE_BRANDS = frozenset({b"heic", b"heix", b"mif1", b"msf1", b"avif", b"avis"})
+
+
+def sniff_image_type(path):
+    """ファイル先頭から画像形式を判定する（画像でなければ None）"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(12)
+    except OSError:
+        return None
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[:4] == b"RIFF" and head[8:12] == b"AVI ":
+        return "avi"
+    if head[4:8] == b"ftyp":  # MP4 / MOV / M4V
+        return None if head[8:12] in _IMAGE_BRANDS else "mp4"
+    for magic, image_type in MAGIC_BYTES:
+        if head.startswith(magic):
+            return image_type
+    return None
+
+
+def iter_images(folder_path, recursive=False, types=DEFAULT_TYPES, cancel_event=None):
+    """フォルダ内の画像のパスを順に返すジェネレータ"""
+    try:
+        with os.scandir(folder_path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return
+    subdirs = []
+    for entry in entries:
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        try:
+            if entry.is_file():
+                if sniff_image_type(entry.path) in types:
+                    yield entry.path
+            elif recursive and entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+        except OSError:
+            continue
+    for subdir in subdirs:
+        yield from iter_images(subdir, recursive, types, cancel_event)
+
+
+class FolderScanner(threading.Thread):
+    """バックグラウンドでフォルダを走査し、見つかった画像を paths に追加していく
+
+    paths は走査中も伸び続けるリストで、メインスレッドからそのまま参照してよい。
+    dedup（cropimage_dedup.Deduplicator）を渡すと、近い重複を除いた画像だけを追加する。
+    perf_log（cropimage_perf.PerfLog）を渡すと、終了時に走査にかかった時間を記録する。
+    """
+
+    def __init__(self, folder_path, recursive=False, types=DEFAULT_TYPES, dedup=None, perf_log=None):
+        super().__init__(daemon=True, name="folder-scanner")
+        self.folder_path = folder_path
+        self.recursive = recursive
+        self.types = types
+        self.dedup = dedup
+        self.perf_log = perf_log
+        self.timings = {}  # ディレクトリの走査にかかった時間
+        self.paths = []
+        self.finished = False
+        self._cancel = threading.Event()
+
+    def run(self):
+        paths = timed_iter(iter_images(self.folder_path, self.recursive, self.types, self._cancel),
+                           "scan", self.timings)
+        if self.dedup is not None:
+            paths = self.dedup.filter(paths)
+        try:
+            for path in paths:
+                if self._cancel.is_set():
+                    break
+                self.paths.append(path)
+        finally:
+            if self.dedup is not None:
+                paths.close()
+                self.dedup.close()
+            if self.perf_log is not None:
+                self.perf_log.record(self.folder_path, "scan", self.timings, count=0, images=len(self.paths),
+                                     duplicates=self.duplicates)
+            self.finished = True
+
+    @property
+    def duplicates(self):
+        return self.dedup.duplicates if self.dedup is not None else 0
+
+    def cancel(self):
+        self._cancel.set()
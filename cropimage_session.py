@@ -0,0 +1,193 @@
+"""作業状況を記録するセッションマニフェスト（JSONL、追記のみ）
+
+1行が1レコードで、元画像・クロップ枠（元画像の座標）・出力パス・状態を記録する。
+fsync はまとめて行う。再起動時はファイルを先頭から読み直して状態を復元し、
+未処理の画像から再開する。マニフェストから出力サイズを変えて一括で再出力することもできる。
+
+使い方（一括再出力）:
+    python cropimage_session.py rerender output/session.jsonl --output-size 512 --output-dir output_512
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+from cropimage_core import DEFAULT_PRESET, OUTPUT_SIZE, PRESETS
+from cropimage_output import DEFAULT_ENCODER, ENCODER_PRESETS, extension
+from cropimage_save import SaveQueue, make_job
+from cropimage_source import parse_frame_ref
+
+MANIFEST_NAME = "session.jsonl"
+
+# レコードの状態
+QUEUED = "queued"    # 保存キューに投入済み（書き込み未完了）
+DONE = "done"        # 書き込み完了
+FAILED = "failed"    # 書き込み失敗（出力のないレコードは読み込みの失敗。再開時に処理し直す）
+SKIPPED = "skipped"  # 出力なしで処理済み（顔が見つからなかった等）
+
+
+def output_name(source_path, suffix="", ext=".png"):
+    """元画像のパスから出力ファイル名を決める（フォルダ内の並び順に依存しない）"""
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    digest = hashlib.sha1(os.path.abspath(source_path).encode("utf-8")).hexdigest()[:8]
+    return f"{stem}_{digest}{suffix}{ext}"
+
+
+class SessionManifest:
+    def __init__(self, path, fsync_every=32, fsync_interval=2.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.outputs = {}  # 出力パス -> 最新のレコード
+        self.sources = {}  # 元画像 -> 出力パスの集合（SKIPPED のみなら空）
+        self.failed_sources = set()  # 読み込みに失敗し、その後に成功のレコードが無い元画像
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        if os.path.exists(path):
+            self._replay()
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() > 0 and not self._ends_with_newline():
+            self._file.write("\n")  # 途中で切れた最後の行の続きに書かないようにする
+
+    def _replay(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 異常終了で途中までしか書かれなかった行
+                self._index(record)
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _index(self, record):
+        outputs = self.sources.setdefault(record["source"], set())
+        if record.get("output"):
+            outputs.add(record["output"])
+            self.outputs[record["output"]] = record
+        if record["status"] != FAILED:
+            # 読み込みに成功した後のレコード（出力の有無を問わない）で読み込み失敗を取り消す
+            self.failed_sources.discard(record["source"])
+        elif not record.get("output"):
+            self.failed_sources.add(record["source"])
+
+    def append(self, source, status, box=None, output=None, output_size=None, pipeline=None, preset=None,
+               encoder=None):
+        record = {
+            "source": os.path.abspath(source),
+            "status": status,
+            "box": list(box) if box is not None else None,
+            "output": output,
+            "output_size": output_size,
+            "pipeline": pipeline,
+            "preset": preset,
+            "encoder": encoder,
+            "time": time.time(),
+        }
+        with self._lock:
+            self._index(record)
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+        return record
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def record_job(self, job, status):
+        """SaveJob の状態を記録する"""
+        return self.append(job.source_path, status, job.box, job.output_path, job.output_size, job.pipeline,
+                           job.preset, job.encoder)
+
+    def is_done(self, source):
+        """出力がすべて書き込み済み（または出力なしで処理済み）か"""
+        source = os.path.abspath(source)
+        outputs = self.sources.get(source)
+        if outputs is None or source in self.failed_sources:
+            return False
+        return all(self.outputs[o]["status"] == DONE for o in outputs)
+
+    def resume_frame(self, video_path):
+        """video_path の出力が記録されている最後のフレームの次の番号（中断した動画の再開位置）
+
+        フレームは順に処理するので、それより前のフレームは処理済み（顔が無かったフレームを含む）。
+        """
+        video_path = os.path.abspath(video_path)
+        last = -1
+        for source, outputs in self.sources.items():
+            frame = parse_frame_ref(source) if outputs else None
+            if frame is not None and frame[0] == video_path:
+                last = max(last, frame[1])
+        return last + 1
+
+    def next_unprocessed(self, image_list, start=0):
+        """start 以降で最初の未処理画像のインデックス（無ければ len(image_list)）"""
+        for i in range(start, len(image_list)):
+            if not self.is_done(image_list[i]):
+                return i
+        return len(image_list)
+
+    def interrupted_jobs(self):
+        """投入済みのまま書き込みが完了しなかったジョブ（クロップ枠は記録済みなので再投入できる）"""
+        return [
+            make_job(r["source"], r["box"], r["output"], r["output_size"], r["pipeline"],
+                     r.get("preset") or DEFAULT_PRESET, r.get("encoder") or DEFAULT_ENCODER)
+            for r in self.outputs.values() if r["status"] == QUEUED
+        ]
+
+    def done_records(self):
+        return [r for r in self.outputs.values() if r["status"] == DONE]
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            self._sync()
+            self._file.close()
+
+
+def rerender(manifest_path, output_dir, output_size, workers=None, preset=None, encoder=None):
+    """マニフェストの完了済みクロップを別の出力サイズ（preset・encoder を渡せば別の画質・形式）で一括再出力する"""
+    manifest = SessionManifest(manifest_path)
+    records = manifest.done_records()
+    manifest.close()
+    os.makedirs(output_dir, exist_ok=True)
+    save_queue = SaveQueue(max_workers=workers, max_pending=(workers or os.cpu_count() or 1) * 4)
+    for r in records:
+        job_encoder = encoder or r.get("encoder") or DEFAULT_ENCODER
+        stem = os.path.splitext(os.path.basename(r["output"]))[0]
+        output_path = os.path.join(output_dir, stem + extension(job_encoder))
+        save_queue.submit(make_job(r["source"], r["box"], output_path, output_size, r["pipeline"],
+                                   preset or r.get("preset") or DEFAULT_PRESET, job_encoder))
+    save_queue.close()
+    return save_queue
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Session manifest tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("rerender", help="re-render every finished crop at a different output size")
+    p.add_argument("manifest")
+    p.add_argument("--output-size", type=int, default=OUTPUT_SIZE)
+    p.add_argument("--output-dir", required=True)
+    p.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    p.add_argument("--preset", choices=PRESETS, default=None, help="output quality (default: as recorded)")
+    p.add_argument("--format", choices=ENCODER_PRESETS, default=None, help="output format (default: as recorded)")
+    args = parser.parse_args(argv)
+
+    encoder = ENCODER_PRESETS[args.format] if args.format else None
+    save_queue = rerender(args.manifest, args.output_dir, args.output_size, args.workers, args.preset, encoder)
+    print(f"Done: {save_queue.saved} crops re-rendered, {save_queue.failed} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""巨大な画像（ギガピクセル級のスキャン、大きな TIFF/PNG）をメモリ上限内で扱う
+
+- 画素数の上限は Pillow の解凍爆弾対策に任せず、open_image で明示的に判定する。
+- デコード後のサイズが MEMORY_LIMIT を超える画像は、全体をメモリに置かない。
+  Pillow が複数のタイル／ストリップとして読む TIFF（非圧縮のタイル・ストリップ）と、
+  非圧縮で1つの領域に格納された画像（1ストリップの非圧縮 TIFF、BMP、PPM など）は必要な部分だけを読む。
+  それ以外（PNG、JPEG、圧縮 TIFF。libtiff で読む TIFF は1タイルになる）は一度だけディスク上のメモリマップに
+  デコードして、以降のプレビュー・クロップはそこから読む（ページキャッシュなので必要に応じて OS が解放できる）。
+  メモリマップに置けるのは L/RGB/RGBA/CMYK の画像だけで、それ以外のモード（P、LA、I;16 など）は
+  SourceTooLargeError にする。
+- メモリマップのファイルはプロセスごとのフォルダ（保存ワーカーは親と共有）に置き、
+  合計が MAP_LIMIT を超えたら最後に使ってから長いものから削除する（必要になればデコードし直す）。
+  異常終了したプロセスのフォルダは、次に起動したときに remove_stale_mapped_sources で削除する。
+
+動画のフレームは "動画のパス#frame=番号" の形の参照で表す（frame_ref）。
+
+上限は環境変数でも指定できる（保存用のワーカープロセスにも引き継がれる）:
+    CROPIMAGE_MEMORY_LIMIT_MB  デコードを直接メモリに置く上限（既定 512）
+    CROPIMAGE_MAX_PIXELS       扱う画像の画素数の上限（既定 10 億）
+    CROPIMAGE_MAP_LIMIT_MB     メモリマップのファイルの合計の上限（既定 8192）
+"""
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+
+import PIL
+from PIL import Image
+
+MEMORY_LIMIT = int(os.environ.get("CROPIMAGE_MEMORY_LIMIT_MB", "512")) * 1024 * 1024
+MAX_SOURCE_PIXELS = int(os.environ.get("CROPIMAGE_MAX_PIXELS", "1000000000"))
+MAP_LIMIT = int(os.environ.get("CROPIMAGE_MAP_LIMIT_MB", "8192")) * 1024 * 1024
+# 同時に動いている別の GUI・一括処理のメモリマップを消さないよう、起動したプロセスごとのフォルダにする
+# （環境変数で保存ワーカーに引き継ぎ、ワーカーは親が作ったメモリマップを再利用する）
+MAP_ROOT = os.path.join(tempfile.gettempdir(), "cropimage_mmap")
+MAP_DIR = os.environ.setdefault("CROPIMAGE_MAP_DIR", os.path.join(MAP_ROOT, str(os.getpid())))
+FRAME_MARK = "#frame="
+
+# Pillow の判定（既定では約 8900 万画素で警告、その 2 倍で例外）も同じ上限にそろえる
+Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+
+# メモリマップに置けるモード（1画素のバイト数。Pillow は RGB も 4 バイトで持つ）
+_MAP_PIXEL_BYTES = {"L": 1, "RGB": 4, "RGBA": 4, "CMYK": 4}
+_MAP_ATTEMPTS = 3  # メモリマップを開く回数（開く前に消されたらデコードし直す）
+# メモリマップ上に直接デコードするのに使う Pillow の内部 API（_buffer_image だけで使う）が使える版か
+_PILLOW_MAP_SUPPORTED = (
+    tuple(int(v) for v in PIL.__version__.split(".")[:2]) >= (9, 0)
+    and hasattr(Image.core, "map_buffer") and hasattr(Image.Image, "_new")
+)
+
+
+class SourceTooLargeError(ValueError):
+    """画素数の上限を超える、またはメモリ上限内で扱えない画像"""
+
+
+def set_limits(memory_limit_mb=None, max_pixels=None, map_limit_mb=None):
+    """上限を変更する（これから起動するワーカープロセスにも環境変数で引き継ぐ）"""
+    global MEMORY_LIMIT, MAX_SOURCE_PIXELS, MAP_LIMIT
+    if memory_limit_mb is not None:
+        MEMORY_LIMIT = memory_limit_mb * 1024 * 1024
+        os.environ["CROPIMAGE_MEMORY_LIMIT_MB"] = str(memory_limit_mb)
+    if max_pixels is not None:
+        MAX_SOURCE_PIXELS = Image.MAX_IMAGE_PIXELS = max_pixels
+        os.environ["CROPIMAGE_MAX_PIXELS"] = str(max_pixels)
+    if map_limit_mb is not None:
+        MAP_LIMIT = map_limit_mb * 1024 * 1024
+        os.environ["CROPIMAGE_MAP_LIMIT_MB"] = str(map_limit_mb)
+
+
+def frame_ref(video_path, index):
+    """動画のフレームを元画像として扱うための参照（マニフェストにもこの形で記録する）"""
+    return f"{video_path}{FRAME_MARK}{index}"
+
+
+def parse_frame_ref(path):
+    """frame_ref の参照なら (動画のパス, フレーム番号)、そうでなければ None"""
+    video_path, mark, index = path.rpartition(FRAME_MARK)
+    if not mark or not index.isdigit():
+        return None
+    return video_path, int(index)
+
+
+def open_image(path):
+    """Image.open と同じだが、画素数の上限を超える画像は SourceTooLargeError にする"""
+    try:
+        image = Image.open(path)
+    except Image.DecompressionBombError as e:
+        raise SourceTooLargeError(f"{path}: {e}") from e
+    width, height = image.size
+    if width * height > MAX_SOURCE_PIXELS:
+        image.close()
+        raise SourceTooLargeError(
+            f"{path}: {width}x{height} exceeds the limit of {MAX_SOURCE_PIXELS:,} pixels"
+        )
+    return image
+
+
+def decoded_bytes(image):
+    """デコードした場合のおおよそのメモリ使用量"""
+    return image.width * image.height * len(image.getbands())
+
+
+def exceeds_memory_limit(image):
+    return decoded_bytes(image) > MEMORY_LIMIT
+
+
+def _map_path(path, image):
+    st = os.stat(path)
+    key = hashlib.sha1(f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}".encode("utf-8")).hexdigest()
+    return os.path.join(MAP_DIR, f"{key}_{image.width}x{image.height}_{image.mode}.raw")
+
+
+def _map_file(path, length, access):
+    with open(path, "r+b" if access == mmap.ACCESS_WRITE else "rb") as f:
+        return mmap.mmap(f.fileno(), length, access=access)
+
+
+def map_source(path):
+    """画像全体をディスク上のメモリマップにデコードし、それを参照する画像を返す
+
+    同じファイルのメモリマップが既にあれば（別のプロセスで作ったものでも）再利用する。
+    """
+    image = open_image(path)
+    pixel_bytes = _MAP_PIXEL_BYTES.get(image.mode)
+    if pixel_bytes is None:
+        image.close()
+        raise SourceTooLargeError(
+            f"{path}: {image.width}x{image.height} {image.mode} image exceeds the memory limit "
+            f"({MEMORY_LIMIT // (1024 * 1024)} MB) and cannot be memory-mapped"
+        )
+    map_path = _map_path(path, image)
+    length = image.width * image.height * pixel_bytes
+    args = (image.mode, 0, 1)
+    size = image.size
+    image.close()
+    for attempt in range(_MAP_ATTEMPTS):
+        try:
+            buffer = _map_file(map_path, length, mmap.ACCESS_READ)
+            break
+        except FileNotFoundError:
+            # まだ無いか、開く前に別の保存ワーカーの _evict に消された（デコードし直す）
+            if attempt == _MAP_ATTEMPTS - 1:
+                raise
+            _decode_to_map(path, map_path, length, args)
+    try:
+        os.utime(map_path)  # 最後に使った時刻（削除の順番に使う）
+    except OSError:
+        pass  # 開いた後に消されても、開いているメモリマップはそのまま読める
+    return _buffer_image(path, buffer, size, args)
+
+
+def _decode_to_map(path, map_path, length, args):
+    """path を map_path のメモリマップにデコードする（一時ファイルに書いてから置き換える）"""
+    os.makedirs(MAP_DIR, exist_ok=True)
+    _evict(MAP_LIMIT - length)
+    image = open_image(path)
+    part_path = f"{map_path}.{os.getpid()}.{threading.get_ident()}.part"
+    with open(part_path, "wb") as f:
+        f.truncate(length)
+    buffer = _map_file(part_path, length, mmap.ACCESS_WRITE)
+    try:
+        _buffer_image(path, buffer, image.size, args, source=image)
+        buffer.flush()
+        buffer.close()
+        os.replace(part_path, map_path)
+    except BaseException:
+        buffer.close()
+        os.remove(part_path)
+        raise
+    finally:
+        image.close()
+
+
+def _buffer_image(path, buffer, size, args, source=None):
+    """buffer（メモリマップ）上の画像を返す。source を渡すと、そのデコード結果を buffer に直接書き込む
+
+    Pillow の公開 API（Image.frombuffer）では RGB（1画素4バイト）の画像をバッファ上に置けないので、
+    内部 API（Image.core.map_buffer、Image.im の差し替え、Image._new）を使う。使えない版では
+    全体をメモリにデコードする代わりに SourceTooLargeError にする。
+    """
+    error = None
+    if _PILLOW_MAP_SUPPORTED:
+        try:
+            core_image = Image.core.map_buffer(buffer, size, "raw", 0, args)
+            if source is not None:
+                # デコーダーにメモリマップ上の画像へ直接書き込ませる
+                source.im = core_image
+                source.load()
+                source.im = None
+                return None
+            mapped = Image.new(args[0], (0, 0))._new(core_image)
+            mapped.readonly = 1  # 書き込む操作はコピーしてから行わせる
+            return mapped
+        except (AttributeError, TypeError) as e:
+            error = e
+    raise SourceTooLargeError(
+        f"{path}: {size[0]}x{size[1]} image exceeds the memory limit ({MEMORY_LIMIT // (1024 * 1024)} MB) "
+        f"and cannot be memory-mapped with Pillow {PIL.__version__}" + (f" ({error})" if error else "")
+    )
+
+
+def _evict(limit):
+    """メモリマップのファイルの合計が limit 以下になるまで、最後に使ってから長いものから削除する
+
+    使用中のファイルを消しても、開いているメモリマップはそのまま読める（POSIX）。
+    消せなかったもの（Windows で使用中など）は残す。
+    """
+    entries = []
+    with os.scandir(MAP_DIR) as it:
+        for entry in it:
+            if entry.name.endswith(".raw"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(entry_path)
+        except OSError:
+            continue
+        total -= size
+
+
+def _process_alive(pid):
+    if os.name == "nt":
+        # Windows の os.kill(pid, 0) はプロセスを終了させてしまうので API で調べる
+        import ctypes
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return ctypes.get_last_error() == 5  # ERROR_ACCESS_DENIED（存在するが権限がない）
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove_stale_mapped_sources():
+    """終了処理をせずに止まった（異常終了・kill された）プロセスのメモリマップのフォルダを削除する（起動時に呼ぶ）"""
+    try:
+        with os.scandir(MAP_ROOT) as it:
+            stale = [entry.path for entry in it
+                     if entry.name.isdigit() and entry.path != MAP_DIR and entry.is_dir()
+                     and not _process_alive(int(entry.name))]
+    except FileNotFoundError:
+        return
+    for stale_path in stale:
+        shutil.rmtree(stale_path, ignore_errors=True)
+
+
+def clear_mapped_sources():
+    """このプロセスのメモリマップのファイルを削除する（終了時に呼ぶ。別のインスタンスのものは消さない）"""
+    shutil.rmtree(MAP_DIR, ignore_errors=True)
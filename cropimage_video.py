@@ -0,0 +1,221 @@
+"""動画ファイルから顔をクロップする（フレームを画像ファイルとして書き出さない）
+
+フレームは OpenCV（opencv-python）でストリームとしてデコードし、メモリ上で検出・クロップする。
+- stride: N フレームごとに1枚を処理する（間のフレームは grab するだけで色変換・コピーをしない）
+- min_change: 直前に処理したフレームとの差がこれ未満のフレームは飛ばす（動きのない場面の重複を減らす）
+- シーンの切り替わり（scene_threshold）か、detect_interval 枚ごとのフレームをキーフレームとして検出し、
+  その間のフレームでは顔の位置を縮小グレースケール上のテンプレートマッチングで追跡する。
+- キーフレームは batch_size 枚ずつまとめて1回の推論にかける。
+
+クロップの元画像は frame_ref（"動画のパス#frame=番号"）としてマニフェストに記録する。
+load_region はこの参照からそのフレームだけをデコードできるので、再開や再出力もそのまま使える。
+"""
+import time
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+import cropimage_source
+from cropimage_boxes import DEFAULT_MERGE_IOU, DEFAULT_MIN_FACE_SIZE
+from cropimage_core import DEFAULT_CONF, crop_region, expand_face_boxes
+from cropimage_detect import letterbox, unletterbox_boxes
+
+DEFAULT_STRIDE = 1
+DEFAULT_DETECT_INTERVAL = 5  # 処理するフレームのうち、この枚数ごとに検出し直す
+DEFAULT_SCENE_THRESHOLD = 30.0  # 縮小グレースケールの平均絶対差（0-255）がこれ以上ならシーンの切り替わり
+TRACK_WIDTH = 640  # 追跡・シーン判定に使う縮小画像の幅
+MIN_TRACK_SCORE = 0.5  # テンプレートマッチングの相関がこれ未満になった顔は見失ったとみなす
+SEARCH_MARGIN = 0.5  # 前の位置から顔の大きさのこの割合まで探す
+
+VideoFrame = namedtuple("VideoFrame", "index time frame gray keyframe")  # frame は RGB の uint8 配列
+VideoDetection = namedtuple("VideoDetection", "frame raw_boxes confidences face_boxes")
+
+
+def _cv2():
+    try:
+        import cv2
+    except ImportError as e:
+        raise ImportError("Video input requires OpenCV: pip install opencv-python-headless") from e
+    return cv2
+
+
+def read_frame(video_path, index):
+    """動画の index 番目のフレームを RGB の画像として読む（シークするので連続して読むには iter_frames を使う）"""
+    cv2 = _cv2()
+    capture = cv2.VideoCapture(video_path)
+    try:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ok, bgr = capture.read()
+    finally:
+        capture.release()
+    if not ok:
+        raise OSError(f"Cannot read frame {index} of {video_path}")
+    return Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+
+
+def _thumbnail(cv2, bgr):
+    height, width = bgr.shape[:2]
+    track_height = max(1, round(height * TRACK_WIDTH / width))
+    small = cv2.resize(bgr, (TRACK_WIDTH, track_height), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+
+def iter_frames(video_path, stride=DEFAULT_STRIDE, min_change=0.0, scene_threshold=DEFAULT_SCENE_THRESHOLD,
+                detect_interval=DEFAULT_DETECT_INTERVAL, start=0):
+    """サンプリングしたフレームを VideoFrame として順に返すジェネレータ
+
+    start を渡すと、それより前のフレームはデコードせずに読み飛ばす（中断した動画の再開）。
+    サンプリングするフレーム番号は start が無い場合と同じで、最初のフレームはキーフレームになる。
+    """
+    cv2 = _cv2()
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise OSError(f"Cannot open video: {video_path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+    index = -1
+    last_gray = None
+    since_detect = detect_interval
+    first = -(-start // stride) * stride  # start 以降で最初にサンプリングするフレーム
+    try:
+        while index + 1 < first:
+            if not capture.grab():
+                return
+            index += 1
+        while True:
+            ok, bgr = capture.read()
+            if not ok:
+                return
+            index += 1
+            gray = _thumbnail(cv2, bgr)
+            change = float(cv2.absdiff(gray, last_gray).mean()) if last_gray is not None else float("inf")
+            if change >= min_change:
+                keyframe = change >= scene_threshold or since_detect >= detect_interval
+                since_detect = 1 if keyframe else since_detect + 1
+                last_gray = gray
+                yield VideoFrame(index, index / fps if fps else None, cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB),
+                                 gray, keyframe)
+            for _ in range(stride - 1):
+                if not capture.grab():
+                    return
+                index += 1
+    finally:
+        capture.release()
+
+
+class FaceTracker:
+    """キーフレームで検出した顔枠を、次のキーフレームまでテンプレートマッチングで追う"""
+
+    def __init__(self, min_score=MIN_TRACK_SCORE, search_margin=SEARCH_MARGIN):
+        self.min_score = min_score
+        self.search_margin = search_margin
+        self._tracks = []  # [縮小画像での (x1, y1, x2, y2), テンプレート, 信頼度]
+        self._scale = 1.0  # 縮小画像 / 元のフレーム
+
+    def reset(self, frame, boxes, confidences):
+        """検出結果（フレーム座標の xyxy）から追跡をやり直す"""
+        self._scale = frame.gray.shape[1] / frame.frame.shape[1]
+        self._tracks = []
+        for box, confidence in zip(boxes, confidences):
+            small = self._clip(frame.gray, [round(v * self._scale) for v in box])
+            if small is not None:
+                self._tracks.append([small, self._patch(frame.gray, small), confidence])
+
+    def update(self, frame):
+        """frame での顔枠（フレーム座標）と信頼度を返す。見失った顔は以降追わない"""
+        cv2 = _cv2()
+        gray = frame.gray
+        tracks = []
+        for (x1, y1, x2, y2), template, confidence in self._tracks:
+            w, h = x2 - x1, y2 - y1
+            margin_x, margin_y = round(w * self.search_margin), round(h * self.search_margin)
+            window = self._clip(gray, (x1 - margin_x, y1 - margin_y, x2 + margin_x, y2 + margin_y))
+            if window is None or window[2] - window[0] < w or window[3] - window[1] < h:
+                continue
+            scores = cv2.matchTemplate(self._patch(gray, window), template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+            if score < self.min_score:
+                continue
+            box = (window[0] + dx, window[1] + dy, window[0] + dx + w, window[1] + dy + h)
+            # テンプレートを更新して、表情や向きのゆっくりした変化に追従する
+            tracks.append([box, self._patch(gray, box), confidence])
+        self._tracks = tracks
+        boxes = [tuple(v / self._scale for v in box) for box, _, _ in tracks]
+        return boxes, [confidence for _, _, confidence in tracks]
+
+    @staticmethod
+    def _clip(gray, box):
+        height, width = gray.shape
+        x1, y1 = max(0, int(box[0])), max(0, int(box[1]))
+        x2, y2 = min(width, int(box[2])), min(height, int(box[3]))
+        if x2 - x1 < 4 or y2 - y1 < 4:  # 小さすぎてマッチングできない
+            return None
+        return (x1, y1, x2, y2)
+
+    @staticmethod
+    def _patch(gray, box):
+        return np.ascontiguousarray(gray[box[1]:box[3], box[0]:box[2]])
+
+
+class VideoFaceDetector:
+    """動画のフレームの顔を、キーフレームはバッチ推論で、それ以外は追跡で求める"""
+
+    def __init__(self, model, batch_size=8, imgsz=None, conf=DEFAULT_CONF,
+                 merge_iou=DEFAULT_MERGE_IOU, min_face_size=DEFAULT_MIN_FACE_SIZE):
+        self.model = model
+        self.batch_size = batch_size
+        self.imgsz = imgsz or model.imgsz
+        self.conf = conf
+        self.merge_iou = merge_iou
+        self.min_face_size = min_face_size
+        self.tracker = FaceTracker()
+        self.frames_detected = 0
+        self.frames_tracked = 0
+        self.elapsed = 0.0  # 推論にかかった時間
+
+    def detect(self, frames):
+        """VideoFrame の列から VideoDetection を順に返すジェネレータ
+
+        キーフレームが batch_size 枚たまるか、保持しているフレームがメモリ上限を超えたら
+        まとめて処理する（追跡の状態は次のまとまりに引き継ぐので、どこで区切ってもよい）。
+        """
+        segment = []
+        keyframes = 0
+        held_bytes = 0
+        for frame in frames:
+            if (frame.keyframe and keyframes >= self.batch_size) or held_bytes >= cropimage_source.MEMORY_LIMIT:
+                yield from self._process(segment)
+                segment, keyframes, held_bytes = [], 0, 0
+            segment.append(frame)
+            keyframes += frame.keyframe
+            held_bytes += frame.frame.nbytes
+        yield from self._process(segment)
+
+    def _process(self, segment):
+        keys = [f for f in segment if f.keyframe]
+        detections = {}
+        if keys:
+            prepared = [letterbox(Image.fromarray(f.frame), self.imgsz) for f in keys]
+            start = time.perf_counter()
+            results = self.model.detect_batch([array for array, _, _ in prepared], self.conf)
+            self.elapsed += time.perf_counter() - start
+            for f, (_, ratio, pad), (boxes, confidences) in zip(keys, prepared, results):
+                detections[f.index] = (unletterbox_boxes(boxes, ratio, pad), confidences)
+        for frame in segment:
+            if frame.keyframe:
+                boxes, confidences = detections[frame.index]
+                self.tracker.reset(frame, boxes, confidences)
+                self.frames_detected += 1
+            else:
+                boxes, confidences = self.tracker.update(frame)
+                self.frames_tracked += 1
+            size = (frame.frame.shape[1], frame.frame.shape[0])
+            face_boxes = expand_face_boxes(boxes, size, confidences,
+                                           merge_iou=self.merge_iou, min_face_size=self.min_face_size)
+            yield VideoDetection(frame, boxes, confidences, face_boxes)
+
+
+def frame_regions(frame, boxes):
+    """メモリ上のフレームからクロップ範囲を切り出す（load_regions と同じ結果）"""
+    image = Image.fromarray(frame.frame)
+    return [crop_region(image, tuple(int(v) for v in box), False) for box in boxes]
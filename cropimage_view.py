@@ -0,0 +1,69 @@
+"""表示（キャンバス）座標と画像内座標の変換（Tk に依存しない）
+
+表示上の位置は 画像内座標 * scale + offset。scale と offset は ViewportRenderer に渡すものと同じ。
+両 GUI の枠の表示・ドラッグ・保存範囲の計算はここを通す。
+"""
+
+MIN_BOX_SIZE = 20  # リサイズで小さくできる枠の一辺（画像内座標）
+
+
+def to_image_point(x, y, scale, offset):
+    """表示上の点を画像内座標にする"""
+    return ((x - offset[0]) / scale, (y - offset[1]) / scale)
+
+
+def to_view_box(box, scale, offset):
+    """画像内座標の枠を表示上の枠にする"""
+    x1, y1, x2, y2 = box
+    return (x1 * scale + offset[0], y1 * scale + offset[1], x2 * scale + offset[0], y2 * scale + offset[1])
+
+
+def to_image_box(box, scale, offset):
+    """表示上の枠を画像内座標の枠にする"""
+    return to_image_point(box[0], box[1], scale, offset) + to_image_point(box[2], box[3], scale, offset)
+
+
+def contains(box, x, y):
+    x1, y1, x2, y2 = box
+    return x1 <= x <= x2 and y1 <= y <= y2
+
+
+def center_box(view_size, size):
+    """表示の中央に置いた一辺 size の正方形（表示上の座標）"""
+    left = (view_size[0] - size) // 2
+    top = (view_size[1] - size) // 2
+    return (left, top, left + size, top + size)
+
+
+def center_crop_box(view_size, size, scale, offset):
+    """表示の中央の一辺 size の枠に写っている範囲（画像内座標、整数）"""
+    left, top, _, _ = to_image_box(center_box(view_size, size), scale, offset)
+    # 右下は左上から一辺 size / scale として求める（従来の丸め方と同じ）
+    return (int(left), int(top), int(left + size / scale), int(top + size / scale))
+
+
+def move_box(box, dx, dy, scale):
+    """表示上で (dx, dy) だけドラッグした枠（画像内座標）"""
+    dx /= scale
+    dy /= scale
+    return (box[0] + dx, box[1] + dy, box[2] + dx, box[3] + dy)
+
+
+def opposite_corner(box, handle_index):
+    """ハンドル（0:左上, 1:右上, 2:左下, 3:右下）の対角の点。リサイズ中はここを固定する"""
+    x1, y1, x2, y2 = box
+    return ((x2, y2), (x1, y2), (x2, y1), (x1, y1))[handle_index]
+
+
+def resize_square(fixed_point, point, min_size=MIN_BOX_SIZE):
+    """fixed_point を固定したまま point の方向へ広げた正方形。min_size 未満になるなら None"""
+    fixed_x, fixed_y = fixed_point
+    dx = point[0] - fixed_x
+    dy = point[1] - fixed_y
+    side = max(abs(dx), abs(dy))
+    if side < min_size:
+        return None
+    # 固定点から見たドラッグの方向に一辺 side だけ伸ばす
+    new_x = fixed_x + (side if dx >= 0 else -side)
+    new_y = fixed_y + (side if dy >= 0 else -side)
+    return (min(fixed_x, new_x), min(fixed_y, new_y), max(fixed_x, new_x), max(fixed_y, new_y))